@@ -1,2 +1,4 @@
-from .debugger import Debugger, Frame
+from .base_debugger import RecordTooLarge
+from .debugger import Debugger, Frame, Page, TracePolicy
+from .heap import Allocation, HeapIndex
 from .compile import compile
@@ -0,0 +1,573 @@
+"""
+Trace agent, run inside GDB's embedded Python interpreter
+
+    -interpreter-exec console "source /path/to/agent.py"
+
+Registers MI commands that walk the stack and the heap with the `gdb.Value`
+API, so that tracing a whole step costs one MI round trip instead of one per
+object, and that keep track of heap allocations as they are made. Requires
+GDB 13 or newer (`gdb.MICommand`).
+
+This module can only be imported by GDB itself.
+"""
+
+import json
+import re
+import time
+
+import gdb
+
+_SKIPPED = {gdb.TYPE_CODE_VOID, gdb.TYPE_CODE_FUNC}
+_AGGREGATES = {gdb.TYPE_CODE_STRUCT, gdb.TYPE_CODE_UNION}
+# As `debugger.MAX_ELEMENTS`
+_MAX_ELEMENTS = 200
+
+
+def _children(value: gdb.Value) -> list[tuple[str, gdb.Value]]:
+    """The children `-var-list-children` would report for `value`"""
+
+    type = value.type.strip_typedefs()
+    if type.code == gdb.TYPE_CODE_PTR:
+        target = type.target().strip_typedefs()
+        if target.code in _SKIPPED or int(value) == 0:
+            return []
+        return [("*", value.dereference())]
+    if type.code == gdb.TYPE_CODE_ARRAY:
+        low, high = type.range()
+        high = min(high, low + _MAX_ELEMENTS - 1)
+        return [(str(i), value[i]) for i in range(low, high + 1)]
+    if type.code in _AGGREGATES:
+        return [
+            (field.name, value[field])
+            for field in type.fields()
+            if field.name is not None
+        ]
+    return []
+
+
+def _describe(value: gdb.Value) -> list | None:
+    """[type, value, address, children] of an addressable value"""
+
+    if value.address is None:
+        return None
+    try:
+        value.fetch_lazy()
+        text = value.format_string()
+    except gdb.error:
+        return None
+
+    # The children of pointers are only needed to follow them, which the
+    # agent does itself
+    type = value.type.strip_typedefs()
+    children = [] if type.code == gdb.TYPE_CODE_PTR else _children(value)
+
+    return [
+        str(value.type),
+        text,
+        hex(int(value.address)),
+        [[name, str(child.type)] for name, child in children],
+    ]
+
+
+def _follow(value: gdb.Value) -> list[tuple[gdb.Value, bool]]:
+    """Children worth tracing, and whether each is a pointer's target"""
+
+    deref = value.type.strip_typedefs().code == gdb.TYPE_CODE_PTR
+    return [
+        # Avoid insepcting each char in each string
+        (child, deref)
+        for _, child in _children(value)
+        if str(child.type) != "char"
+    ]
+
+
+class _Budget:
+    """Agent side of `TracePolicy`, counting followed pointers"""
+
+    def __init__(self, options: dict[str, list[str]]) -> None:
+        self.max_nodes = _option(options, "--max-nodes", int)
+        self.max_depth = _option(options, "--max-depth", int)
+        self.deadline = _option(options, "--deadline", float)
+        self.start = time.monotonic()
+        self.nodes = 0
+
+    def admit(self, depth: int) -> bool:
+        if (
+            self.max_depth is not None
+            and depth > self.max_depth
+            or self.max_nodes is not None
+            and self.nodes >= self.max_nodes
+            or self.deadline is not None
+            and time.monotonic() - self.start > self.deadline
+        ):
+            return False
+        self.nodes += 1
+        return True
+
+
+def _option(options: dict[str, list[str]], name: str, parse: type) -> any:
+    return parse(options[name][0]) if name in options else None
+
+
+def _enqueue(
+    value: gdb.Value,
+    depth: int,
+    queue: list[tuple[gdb.Value, int]],
+    seen: set[tuple[str, str]],
+    budget: _Budget,
+    stubs: list[list],
+) -> None:
+    """
+    Queue the children of `value`, which was reached by following `depth`
+    pointers. Pointers the budget does not admit are recorded as `stubs`.
+    """
+
+    try:
+        followed = _follow(value)
+    except gdb.MemoryError:
+        return
+    for child, deref in followed:
+        if not deref:
+            queue.append((child, depth))
+            continue
+        # The target of a pointer is only read if it gets admitted
+        key = (hex(int(value)), str(child.type))
+        if key in seen:
+            continue
+        if budget.admit(depth + 1):
+            queue.append((child, depth + 1))
+        else:
+            seen.add(key)
+            stubs.append([key[1], key[0]])
+
+
+def _walk(
+    queue: list[tuple[gdb.Value, int]],
+    seen: set[tuple[str, str]],
+    budget: _Budget,
+    objects: list[list],
+    stubs: list[list],
+) -> None:
+    while queue:
+        level, queue = queue, list[tuple[gdb.Value, int]]()
+        for value, depth in level:
+            described = _describe(value)
+            if described is None or (described[2], described[0]) in seen:
+                continue
+            seen.add((described[2], described[0]))
+            objects.append(described)
+            _enqueue(value, depth, queue, seen, budget, stubs)
+
+
+def _frame_variables(frame: gdb.Frame) -> dict[str, gdb.Value]:
+    variables = dict[str, gdb.Value]()
+    try:
+        block = frame.block()
+    except RuntimeError:
+        return variables
+
+    while block is not None:
+        for symbol in block:
+            if (symbol.is_variable or symbol.is_argument) and (
+                symbol.name not in variables
+            ):
+                variables[symbol.name] = symbol.value(frame)
+        if block.function is not None:
+            break
+        block = block.superblock
+    return variables
+
+
+def trace(options: dict[str, list[str]]) -> dict:
+    """
+    Same walk as `Debugger.trace`: every frame's variables, then everything
+    reachable from them, breadth first, without looking into strings.
+    """
+
+    frames = list[dict]()
+    objects = list[list]()
+    stubs = list[list]()
+    seen = set[tuple[str, str]]()
+    budget = _Budget(options)
+    max_frames = _option(options, "--frames", int)
+
+    frame = gdb.newest_frame()
+    while frame is not None and max_frames != len(frames):
+        sal = frame.find_sal()
+        vars = dict[str, list]()
+        queue = list[tuple[gdb.Value, int]]()
+        for name, value in _frame_variables(frame).items():
+            described = _describe(value)
+            if described is None:
+                continue
+            vars[name] = described
+            seen.add((described[2], described[0]))
+            _enqueue(value, 0, queue, seen, budget, stubs)
+        _walk(queue, seen, budget, objects, stubs)
+
+        frames.append(
+            {
+                "func": frame.name(),
+                "file": sal.symtab.filename if sal.symtab else "",
+                "line": sal.line,
+                "vars": vars,
+            }
+        )
+        frame = frame.older()
+
+    return {"frames": frames, "objects": objects, "stubs": stubs}
+
+
+def expand(options: dict[str, list[str]]) -> dict:
+    """Same walk, from the single object at `--expand ADDR TYPE`"""
+
+    addr, type = options["--expand"]
+    value = gdb.parse_and_eval(f"*({type} *) {addr}")
+    objects = list[list]()
+    stubs = list[list]()
+    _walk([(value, 0)], set(), _Budget(options), objects, stubs)
+    return {"frames": [], "objects": objects, "stubs": stubs}
+
+
+def describe(level: int, exprs: list[str]) -> list:
+    """
+    [type, value, address, children] of each of `exprs` in the `level`th
+    frame, with children as `-var-list-children` lists them, or the error
+    GDB raised as {"error": message}
+    """
+
+    selected = gdb.selected_frame()
+    frame = gdb.newest_frame()
+    for _ in range(level):
+        frame = frame.older()
+        if frame is None:
+            raise gdb.GdbError(f"No frame at level {level}")
+    frame.select()
+    try:
+        details = list[list | dict]()
+        for expr in exprs:
+            try:
+                value = gdb.parse_and_eval(expr)
+                value.fetch_lazy()
+                text = value.format_string()
+                if value.address is None:
+                    raise gdb.error("Attempt to take address of value")
+                details.append(
+                    [
+                        str(value.type),
+                        text,
+                        hex(int(value.address)),
+                        _var_children(expr, value),
+                    ]
+                )
+            except gdb.error as e:
+                details.append({"error": str(e)})
+        return details
+    finally:
+        selected.select()
+
+
+def _var_children(expr: str, value: gdb.Value) -> list[list[str]]:
+    """Pointers list what they point to, as varobjs do"""
+
+    type = value.type.strip_typedefs()
+    if type.code != gdb.TYPE_CODE_PTR:
+        return [[name, str(child.type)] for name, child in _children(value)]
+    target = type.target()
+    code = target.strip_typedefs().code
+    if code in _SKIPPED:
+        return []
+    if code in _AGGREGATES:
+        return [
+            [field.name, str(field.type)]
+            for field in target.strip_typedefs().fields()
+            if field.name is not None
+        ]
+    return [[f"*{expr}", str(target)]]
+
+
+def _options(argv: list[str]) -> dict[str, list[str]]:
+    """
+    >>> _options(["--max-nodes", "10", "--expand", "0x10", "struct node"])
+    {'--max-nodes': ['10'], '--expand': ['0x10', 'struct node']}
+    """
+
+    options = dict[str, list[str]]()
+    for arg in argv:
+        if arg.startswith("--"):
+            options[arg] = []
+        else:
+            options[next(reversed(options))].append(arg)
+    return options
+
+
+# Registers holding (first argument, second argument, return value)
+_REGISTERS = {
+    "i386:x86-64": ("rdi", "rsi", "rax"),
+    "aarch64": ("x0", "x1", "x0"),
+    "riscv:rv64": ("a0", "a1", "a0"),
+}
+
+
+class _Allocations:
+    """
+    Live heap blocks, as [address, size, call-site line, step] keyed by
+    address, where steps are the `Debugger.step` each block was allocated
+    during (see -structs-allocations-step)
+    """
+
+    def __init__(self) -> None:
+        self.live = dict[int, list]()
+        self.step = 0
+        self.snapshots = dict[str, tuple[dict[int, list], int]]()
+        self.breakpoints = list[gdb.Breakpoint]()
+        # Allocating calls in flight, as (old block, size, line) by return
+        # address, innermost last
+        self.calls = dict[int, list[tuple[int | None, int, int]]]()
+
+    def track(self, functions: list[str]) -> None:
+        if self.breakpoints:
+            return
+        # Refused up front, as an error in `stop` would stop the program
+        _registers(gdb.selected_inferior().architecture())
+        # Breakpoints must not be added from `stop`, so every call site the
+        # program allocates from gets its return breakpoint now
+        self.breakpoints = [
+            _AllocationBreakpoint(self, function)
+            for function in ("malloc", "calloc", "realloc", "free")
+        ]
+        self.breakpoints += [
+            _ReturnBreakpoint(self, location)
+            for location in _call_returns(functions)
+        ]
+
+    def called(self, ret: int, old: int | None, size: int, line: int) -> None:
+        self.calls.setdefault(ret, []).append((old, size, line))
+
+    def returned(self, ret: int, addr: int) -> None:
+        calls = self.calls.get(ret)
+        if not calls:
+            return
+        old, size, line = calls.pop()
+        if old is not None and (addr != 0 or size == 0):
+            # realloc only frees the old block if it succeeded
+            self.freed(old)
+        if addr != 0:
+            self.live[addr] = [hex(addr), size, line, self.step]
+
+    def freed(self, addr: int) -> None:
+        self.live.pop(addr, None)
+
+
+# Calls to the allocating functions, e.g. "call 0x1030 <malloc@plt>" on
+# x86-64 or "bl 0x640 <malloc@plt>" on aarch64
+_ALLOCATING_CALL = re.compile(
+    r"^\s*(?:call|bl|jal)\w*\s.*<(?:malloc|calloc|realloc)(?:@plt)?>"
+)
+
+
+def _call_returns(functions: list[str]) -> list[str]:
+    """
+    Where calls to malloc, calloc and realloc in `functions` return to, as
+    breakpoint locations that follow the program wherever it is loaded
+    """
+
+    arch = gdb.selected_inferior().architecture()
+    locations = list[str]()
+    for name in functions:
+        symbol = gdb.lookup_global_symbol(name) or gdb.lookup_static_symbol(
+            name
+        )
+        if symbol is None or symbol.type.code != gdb.TYPE_CODE_FUNC:
+            continue
+        start = int(symbol.value().address)
+        block = gdb.block_for_pc(start)
+        while block is not None and block.function is None:
+            block = block.superblock
+        if block is None:
+            continue
+        for insn in arch.disassemble(block.start, block.end - 1):
+            if _ALLOCATING_CALL.search(insn["asm"]):
+                offset = insn["addr"] + insn["length"] - start
+                locations.append(f"*{name} + {offset}")
+    return locations
+
+
+def _registers(arch: gdb.Architecture) -> tuple[str, str, str]:
+    name = arch.name()
+    if name not in _REGISTERS:
+        raise gdb.GdbError(f"Cannot track allocations on {name}")
+    return _REGISTERS[name]
+
+
+class _AllocationBreakpoint(gdb.Breakpoint):
+    """
+    Never stops: reads the arguments on entry, for the `_ReturnBreakpoint`
+    at the call's return address to match with the result
+    """
+
+    def __init__(self, allocations: _Allocations, function: str) -> None:
+        super().__init__(function, internal=True)
+        self.allocations = allocations
+        self.function = function
+
+    def stop(self) -> bool:
+        frame = gdb.newest_frame()
+        caller = frame.older()
+        if caller is None or caller.find_sal().symtab is None:
+            # Only calls made by the program itself, not by its libraries
+            return False
+
+        first, second, _ = _registers(frame.architecture())
+        arg0 = int(frame.read_register(first))
+        arg1 = int(frame.read_register(second))
+        ret = caller.pc()
+        line = caller.find_sal().line
+        if self.function == "free":
+            self.allocations.freed(arg0)
+        elif self.function == "malloc":
+            self.allocations.called(ret, None, arg0, line)
+        elif self.function == "calloc":
+            self.allocations.called(ret, None, arg0 * arg1, line)
+        else:
+            self.allocations.called(ret, arg0, arg1, line)
+        return False
+
+
+class _ReturnBreakpoint(gdb.Breakpoint):
+    """Never stops: reads the result of the call that returns here"""
+
+    def __init__(self, allocations: _Allocations, location: str) -> None:
+        super().__init__(location, internal=True)
+        self.allocations = allocations
+
+    def stop(self) -> bool:
+        frame = gdb.newest_frame()
+        _, _, result = _registers(frame.architecture())
+        addr = int(frame.read_register(result))
+        self.allocations.returned(frame.pc(), addr)
+        return False
+
+
+_allocations = _Allocations()
+
+
+class AllocationsSnapshotCommand(gdb.MICommand):
+    """
+    -structs-allocations-snapshot save|restore|drop KEY
+
+    Checkpoints fork the inferior but not this agent, so the allocations
+    recorded at each checkpoint are saved alongside it.
+    """
+
+    def __init__(self) -> None:
+        super().__init__("-structs-allocations-snapshot")
+
+    def invoke(self, argv: list[str]) -> None:
+        action, key = argv
+        if action == "save":
+            _allocations.snapshots[key] = (
+                dict(_allocations.live),
+                _allocations.step,
+            )
+        elif action == "restore":
+            live, step = _allocations.snapshots[key]
+            _allocations.live, _allocations.step = dict(live), step
+        elif action == "drop":
+            _allocations.snapshots.pop(key, None)
+        else:
+            raise gdb.GdbError(f"Unknown action {action}")
+
+
+class TrackAllocationsCommand(gdb.MICommand):
+    """
+    -structs-track-allocations FUNCTION...
+
+    Start keeping track of the blocks the program allocates with malloc,
+    calloc and realloc and releases with free, from calls in FUNCTIONs.
+    """
+
+    def __init__(self) -> None:
+        super().__init__("-structs-track-allocations")
+
+    def invoke(self, argv: list[str]) -> None:
+        _allocations.track(argv)
+
+
+class AllocationsStepCommand(gdb.MICommand):
+    """
+    -structs-allocations-step STEP
+
+    Record blocks allocated from now on as allocated during STEP.
+    """
+
+    def __init__(self) -> None:
+        super().__init__("-structs-allocations-step")
+
+    def invoke(self, argv: list[str]) -> None:
+        (step,) = argv
+        _allocations.step = int(step)
+
+
+class AllocationsCommand(gdb.MICommand):
+    """
+    -structs-allocations
+
+    The step count and the live blocks, as [address, size, call-site line,
+    step allocated at]
+    """
+
+    def __init__(self) -> None:
+        super().__init__("-structs-allocations")
+
+    def invoke(self, argv: list[str]) -> dict:
+        return {
+            "step": str(_allocations.step),
+            "blocks": list(_allocations.live.values()),
+        }
+
+
+class TraceCommand(gdb.MICommand):
+    """
+    -structs-trace [--max-nodes N] [--max-depth N] [--deadline SECONDS]
+                   [--frames N] [--expand ADDR TYPE]
+
+    The whole traced memory graph as one JSON document. The document is
+    hex encoded so that it reaches the client without going through MI's
+    c-string escaping. Pointers past the budget are listed as "stubs".
+    """
+
+    def __init__(self) -> None:
+        super().__init__("-structs-trace")
+
+    def invoke(self, argv: list[str]) -> dict:
+        options = _options(argv)
+        doc = expand(options) if "--expand" in options else trace(options)
+        return {"trace": json.dumps(doc, separators=(",", ":")).encode().hex()}
+
+
+class DescribeCommand(gdb.MICommand):
+    """
+    -structs-describe LEVEL EXPR...
+
+    What `Debugger.vars_details` reads with five MI commands per expression,
+    for all EXPRs at once, as a hex encoded JSON list (see `describe`).
+    """
+
+    def __init__(self) -> None:
+        super().__init__("-structs-describe")
+
+    def invoke(self, argv: list[str]) -> dict:
+        level, *exprs = argv
+        doc = describe(int(level), exprs)
+        return {
+            "details": json.dumps(doc, separators=(",", ":")).encode().hex()
+        }
+
+
+TraceCommand()
+DescribeCommand()
+TrackAllocationsCommand()
+AllocationsStepCommand()
+AllocationsCommand()
+AllocationsSnapshotCommand()
@@ -1,28 +1,67 @@
 from asyncio import create_subprocess_exec
 from asyncio import create_task
-from asyncio import Queue
-from asyncio import to_thread
+from asyncio import gather
+from asyncio import get_running_loop
 from asyncio import Event
+from asyncio import Future
 from asyncio import iscoroutinefunction
+from asyncio import StreamReader
 from asyncio.subprocess import PIPE
 from collections import deque
-from contextlib import suppress
+from collections.abc import AsyncIterator
+from codecs import getincrementaldecoder
+from itertools import count
 from pathlib import Path
+from signal import SIGINT
 import os
 
 from . import mion
 
+READ_SIZE = 64 * 1024
+# Inferior output read in one go is passed on as a single chunk, up to this
+MAX_CHUNK = 1024 * 1024
+# Records from GDB longer than this are dropped by default
+MAX_RECORD_SIZE = 64 * 1024 * 1024
+# How much of a dropped record is kept to tell what it was
+RECORD_HEAD = 64
+
+
+class RecordTooLarge(ValueError):
+    """
+    What a command or `run_exec` fails with when GDB's reply to it is over
+    the maximum record size
+    """
+
+    def __init__(self, head: str, size: int, limit: int) -> None:
+        super().__init__(
+            f"GDB record of {size} bytes is over the limit of {limit} bytes"
+        )
+        self.head = head
+        self.size = size
+        self.limit = limit
+
 
 class BaseDebugger:
-    def __init__(self) -> None:
+    def __init__(self, max_record_size: int | None = MAX_RECORD_SIZE) -> None:
+        self.max_record_size = max_record_size
         do_nothing = lambda *args, **kwargs: None
         self.oob_handler = do_nothing
         self.inferior_handler = do_nothing
         self._inferior_dispatch_done = Event()
         self._inferior_dispatch_done.set()
+        self._inferior_readable = Event()
+        self._inferior_closing = False
+        self._inferior_decoder = getincrementaldecoder("utf-8")(
+            errors="replace"
+        )
         self._did_init = False
 
-    async def init(self, executable_path: str | Path) -> None:
+    async def init(self, executable_path: str | Path | None = None) -> None:
+        """
+        Start GDB, with a pty for the inferior, and load `executable_path`
+        into it now if given, or later with `load`
+        """
+
         self.fd_master, self.fd_slave = os.openpty()
         self.process = await create_subprocess_exec(
             "gdb",
@@ -32,19 +71,35 @@ class BaseDebugger:
             "-nh",
             "--tty",
             os.ttyname(self.fd_slave),
-            "--args",
-            str(executable_path),
             stdin=PIPE,
             stdout=PIPE,
         )
 
-        self.result_queue = Queue[tuple[str, dict]]()
+        self.tokens = count(1)
+        self.pending = dict[int, Future[dict]]()
+        self.stop: Future[dict] | None = None
         self.stream_queue = deque[str](maxlen=0)
         create_task(self._stdout_dispatch())
+        # Cleared now, so that `deinit` waits even if it has not started yet
+        self._inferior_dispatch_done.clear()
         create_task(self._inferior_dispatch())
         self._did_init = True
+        if executable_path is not None:
+            await self.load(executable_path)
         return self
 
+    async def load(self, executable_path: str | Path) -> None:
+        path = str(executable_path).replace("\\", "\\\\").replace('"', '\\"')
+        await self.run_command(f'-file-exec-and-symbols "{path}"')
+
+    def alive(self) -> bool:
+        return self._did_init and self.process.returncode is None
+
+    def interrupt(self) -> None:
+        """Stop the running inferior, as Ctrl-C in GDB would"""
+
+        self.process.send_signal(SIGINT)
+
     async def deinit(self) -> None:
         if not self._did_init:
             return
@@ -53,45 +108,75 @@ class BaseDebugger:
         await self.process.stdin.drain()
         await self.process.wait()
 
-        self.result_queue.shutdown()
-        await self.result_queue.join()
-
+        self._inferior_closing = True
+        self._inferior_readable.set()
+        await self._inferior_dispatch_done.wait()
         os.close(self.fd_master)
         os.close(self.fd_slave)
-        await self._inferior_dispatch_done.wait()
 
     async def run_command(self, command: str):
-        self.process.stdin.write(f"{command}\n".encode())
+        (result,) = await self.run_commands([command])
+        return result
+
+    async def run_commands(
+        self, commands: list[str], return_exceptions: bool = False
+    ) -> list:
+        """
+        Send every command before waiting on any of them, so that the whole
+        batch costs a single round trip to GDB. Results are returned in the
+        same order as `commands`.
+        """
+
+        futures = [self._submit(command) for command in commands]
         await self.process.stdin.drain()
 
-        subkind, result = await self.result_queue.get()
-        self.result_queue.task_done()
-        if subkind == mion.RESULT_ERROR:
-            raise ValueError(result["msg"])
-        assert subkind in mion.RESULT_CLASS
-        return result
+        results = await gather(*futures, return_exceptions=True)
+        if not return_exceptions:
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+        return results
+
+    async def run_exec(self, command: str) -> dict:
+        """
+        Run an -exec-* command, and return the *stopped record GDB reports
+        once the inferior stops again
+        """
+
+        stop = self.stop = get_running_loop().create_future()
+        await self.run_command(command)
+        return await stop
 
     async def console(self, command: str):
         """Experimental"""
 
         self.stream_queue = deque[str](maxlen=None)
-        self.process.stdin.write(
-            f'-interpreter-exec console "{command}"\n'.encode()
-        )
+        try:
+            result = await self.run_command(
+                f'-interpreter-exec console "{command}"'
+            )
+            assert result == {}
 
-        subkind, result = await self.result_queue.get()
-        self.result_queue.task_done()
-        if subkind == mion.RESULT_ERROR:
-            raise ValueError(result["msg"])
-        assert subkind in mion.RESULT_CLASS
-        assert result == {}
+            return "".join(
+                line[1:-1].encode().decode("unicode_escape")
+                for line in self.stream_queue
+            )
+        finally:
+            self.stream_queue = deque[str](maxlen=0)
 
-        res = "".join(
-            line[1:-1].encode().decode("unicode_escape")
-            for line in self.stream_queue
-        )
-        self.stream_queue = deque[str](maxlen=0)
-        return res
+    def _submit(self, command: str) -> Future[dict]:
+        """Write a token-tagged command without waiting for its result"""
+
+        if command.startswith("-exec-"):
+            self.invalidate()
+        token = next(self.tokens)
+        future = get_running_loop().create_future()
+        self.pending[token] = future
+        self.process.stdin.write(f"{token}{command}\n".encode())
+        return future
+
+    def invalidate(self) -> None:
+        """Called whenever the inferior may have run, see `Debugger`"""
 
     def on_oob[F](self, func: F) -> F:
         """oob = out of band"""
@@ -104,22 +189,56 @@ class BaseDebugger:
         return func
 
     async def _stdout_dispatch(self) -> None:
-        while line := await self.process.stdout.readline():
-            line = line.strip().decode()
-            if line == "(gdb)":
+        try:
+            await self._dispatch_records()
+        finally:
+            # Nothing will answer the commands still in flight
+            for future in self.pending.values():
+                future.cancel()
+            self.pending.clear()
+            if self.stop is not None:
+                self.stop.cancel()
+
+    async def _dispatch_records(self) -> None:
+        async for record in _records(
+            self.process.stdout, self.max_record_size
+        ):
+            if isinstance(record, RecordTooLarge):
+                self._fail(record)
+                continue
+            record = record.strip()
+            if record == b"(gdb)":
+                continue
+            digits = len(record) - len(record.lstrip(b"0123456789"))
+            if (
+                record[digits : digits + 1].decode() in mion.STREAM
+                and self.stream_queue.maxlen == 0
+            ):
+                # Nobody is listening, so it is not worth decoding
                 continue
 
+            token, line = _split_token(record.decode())
             kind, message = line[:1], line[1:]
             match kind:
                 case mion.RESULT:
                     subkind, message = _split_subkind(message)
-                    await self.result_queue.put((subkind, mion.loads(message)))
+                    self._resolve(token, subkind, mion.loads(message))
                 case _ if kind in mion.ASYNC:
                     subkind, message = _split_subkind(message)
+                    record = mion.loads(message)
+                    if subkind in ("running", "stopped"):
+                        self.invalidate()
+                    if subkind == "stopped" and self.stop is not None:
+                        # What the inferior printed before it stopped goes
+                        # to whoever is waiting on this stop, not the next
+                        await self._drain_inferior()
+                        if not self.stop.done():
+                            self.stop.set_result(record)
+                        self.stop = None
                     if iscoroutinefunction(self.oob_handler):
-                        await self.oob_handler((subkind, mion.loads(message)))
+                        await self.oob_handler((subkind, record))
                     else:
-                        self.oob_handler((subkind, mion.loads(message)))
+                        self.oob_handler((subkind, record))
                 case _ if kind in mion.STREAM:
                     self.stream_queue.append(message)
                 case _:
@@ -127,15 +246,159 @@ class BaseDebugger:
                         f"Received unknown message kind from GDB: {kind}"
                     )
 
+    def _fail(self, error: RecordTooLarge) -> None:
+        """Fail whatever was waiting for the record that was dropped"""
+
+        token, line = _split_token(error.head)
+        if line.startswith(mion.RESULT):
+            future = self.pending.pop(token, None)
+        elif line.startswith(mion.EXEC_ASYNC + "stopped"):
+            future, self.stop = self.stop, None
+        else:
+            return
+        if future is not None and not future.done():
+            future.set_exception(error)
+
+    def _resolve(self, token: int | None, subkind: str, result: dict) -> None:
+        future = self.pending.pop(token, None)
+        if future is None or future.done():
+            return
+        if subkind == mion.RESULT_ERROR:
+            future.set_exception(ValueError(result["msg"]))
+        else:
+            assert subkind in mion.RESULT_CLASS
+            future.set_result(result)
+
     async def _inferior_dispatch(self) -> None:
-        self._inferior_dispatch_done.clear()
-        with suppress(OSError):
-            while output := await to_thread(os.read, self.fd_master, 512):
-                if iscoroutinefunction(self.inferior_handler):
-                    await self.inferior_handler(output.decode())
-                else:
-                    self.inferior_handler(output.decode())
-        self._inferior_dispatch_done.set()
+        """
+        Read the pty whenever the event loop sees it readable, rather than
+        tying up a thread in a blocking read for the whole session
+        """
+
+        loop = get_running_loop()
+        os.set_blocking(self.fd_master, False)
+        loop.add_reader(self.fd_master, self._inferior_readable.set)
+        try:
+            alive = True
+            while alive:
+                await self._inferior_readable.wait()
+                self._inferior_readable.clear()
+                chunk, alive = _read_available(self.fd_master)
+                # Once closing, what was left has just been read
+                alive = alive and not self._inferior_closing
+                await self._inferior_output(chunk, final=not alive)
+        finally:
+            loop.remove_reader(self.fd_master)
+            self._inferior_dispatch_done.set()
+
+    async def _drain_inferior(self) -> None:
+        """Pass on whatever inferior output the pty holds right now"""
+
+        if self._inferior_dispatch_done.is_set() or self._inferior_closing:
+            return
+        chunk, alive = _read_available(self.fd_master)
+        await self._inferior_output(chunk)
+        if not alive:
+            # For `_inferior_dispatch` to find out too
+            self._inferior_readable.set()
+
+    async def _inferior_output(
+        self, chunk: bytes, final: bool = False
+    ) -> None:
+        if output := self._inferior_decoder.decode(chunk, final=final):
+            if iscoroutinefunction(self.inferior_handler):
+                await self.inferior_handler(output)
+            else:
+                self.inferior_handler(output)
+
+
+async def _records(
+    stream: StreamReader, limit: int | None
+) -> AsyncIterator[bytes | RecordTooLarge]:
+    """
+    Newline-terminated records from `stream`, however long, framed in one
+    buffer that is reused throughout. A record over `limit` bytes is not
+    kept, but given as a `RecordTooLarge`.
+
+    >>> from asyncio import run
+    >>> async def demo():
+    ...     stream = StreamReader()
+    ...     stream.feed_data(b'^done\\n~"' + b"x" * 100 + b'"\\n5^do')
+    ...     stream.feed_data(b"ne\\n")
+    ...     stream.feed_eof()
+    ...     return [
+    ...         record if isinstance(record, bytes) else record.size
+    ...         async for record in _records(stream, limit=64)
+    ...     ]
+    >>> run(demo())
+    [b'^done', 103, b'5^done']
+    """
+
+    buffer = bytearray()
+    # Bytes of the record being read that were already dropped
+    dropped = 0
+    head = b""
+    while chunk := await stream.read(READ_SIZE):
+        # Only the new bytes can hold the end of the record being read
+        scan = len(buffer)
+        buffer += chunk
+        start = 0
+        while (end := buffer.find(b"\n", scan)) != -1:
+            size = dropped + end - start
+            if limit is not None and size > limit:
+                head = head or bytes(buffer[start : start + RECORD_HEAD])
+                yield RecordTooLarge(
+                    head.decode(errors="replace"), size, limit
+                )
+            else:
+                yield bytes(buffer[start:end])
+            start = scan = end + 1
+            dropped = 0
+            head = b""
+        del buffer[:start]
+        if limit is not None and dropped + len(buffer) > limit:
+            head = head or bytes(buffer[:RECORD_HEAD])
+            dropped += len(buffer)
+            buffer.clear()
+
+
+def _read_available(fd: int) -> tuple[bytes, bool]:
+    """
+    Everything `fd` has to give without blocking (up to `MAX_CHUNK`), and
+    whether it is still open
+    """
+
+    chunks = list[bytes]()
+    size = 0
+    try:
+        while size < MAX_CHUNK:
+            chunk = os.read(fd, READ_SIZE)
+            if not chunk:
+                return b"".join(chunks), False
+            chunks.append(chunk)
+            size += len(chunk)
+    except BlockingIOError:
+        pass
+    except OSError:
+        # EIO once the other side of the pty is gone
+        return b"".join(chunks), False
+    # Whatever is left makes the pty readable again on the next loop
+    # iteration, after others had their turn
+    return b"".join(chunks), True
+
+
+def _split_token(line: str) -> tuple[int | None, str]:
+    """
+    >>> _split_token('12^done')
+    (12, '^done')
+    >>> _split_token('*stopped,reason="exited"')
+    (None, '*stopped,reason="exited"')
+    """
+
+    digits = len(line) - len(line.lstrip("0123456789"))
+    if digits == 0:
+        return None, line
+    return int(line[:digits]), line[digits:]
 
 
 def _split_subkind(message: str) -> tuple[str, str]:
@@ -0,0 +1,68 @@
+from __future__ import annotations
+from bisect import bisect_right
+from dataclasses import dataclass
+from dataclasses import field
+
+"""Which steps have a GDB checkpoint (a forked copy of the inferior)"""
+
+
+@dataclass(slots=True)
+class Checkpoints:
+    """
+    Checkpoints taken every `interval` steps. Past `limit` of them, every
+    other one is dropped and the interval doubles, so they keep covering
+    the whole run at a coarser grain.
+
+    >>> checkpoints = Checkpoints(interval=2, limit=3)
+    >>> [step for step in range(9) if checkpoints.due(step)]
+    [0, 2, 4, 6, 8]
+    >>> for id, step in enumerate(range(0, 6, 2), 1):
+    ...     checkpoints.add(step, id)
+    []
+    []
+    []
+    >>> checkpoints.add(6, 4)
+    [2, 4]
+    >>> checkpoints.steps, checkpoints.interval
+    ([0, 4], 4)
+    >>> checkpoints.nearest(7)
+    (4, 3)
+    """
+
+    interval: int
+    limit: int
+    steps: list[int] = field(default_factory=list)
+    ids: dict[int, int] = field(default_factory=dict)
+
+    def due(self, step: int) -> bool:
+        return step % self.interval == 0 and step not in self.ids
+
+    def add(self, step: int, id: int) -> list[int]:
+        """Record a checkpoint, returning the ids of those to delete"""
+
+        stale = [self.ids[step]] if step in self.ids else []
+        if step not in self.ids:
+            self.steps.insert(bisect_right(self.steps, step), step)
+        self.ids[step] = id
+        while len(self.steps) > self.limit:
+            self.interval *= 2
+            for dropped in self.steps:
+                if dropped % self.interval != 0:
+                    stale.append(self.ids.pop(dropped))
+            self.steps = [step for step in self.steps if step in self.ids]
+        return stale
+
+    def nearest(self, step: int) -> tuple[int, int] | None:
+        """(step, id) of the latest checkpoint at or before `step`"""
+
+        i = bisect_right(self.steps, step) - 1
+        if i < 0:
+            return None
+        return self.steps[i], self.ids[self.steps[i]]
+
+    def discard(self, after: int) -> list[int]:
+        """Forget the checkpoints past step `after`, returning their ids"""
+
+        stale = [self.ids.pop(step) for step in self.steps if step > after]
+        self.steps = [step for step in self.steps if step <= after]
+        return stale
@@ -1,13 +1,54 @@
 from __future__ import annotations
-from collections import deque
+from asyncio import create_task
+from asyncio import wait
+from asyncio import FIRST_COMPLETED
+from asyncio import gather
+from asyncio import get_running_loop
+from asyncio import Queue
+from asyncio import shield
+from asyncio import Future
+from collections.abc import AsyncIterator
+from collections.abc import Awaitable
+from collections.abc import Callable
+from collections.abc import Collection
 from contextlib import suppress
 from dataclasses import dataclass
-from json import JSONDecodeError
+from dataclasses import field
+from functools import partial
+from json import loads
+from logging import warning
+from pathlib import Path
+from re import IGNORECASE
+from re import search
+from time import monotonic
 from typing import TypedDict
 
 from debugger import mion
 
 from .base_debugger import BaseDebugger
+from .base_debugger import MAX_RECORD_SIZE
+from .checkpoints import Checkpoints
+from .heap import Allocation
+from .heap import HeapIndex
+from .layout import ARRAY
+from .layout import POINTER
+from .layout import STRUCT
+from .layout import Field
+from .layout import Layout
+from .layout import children
+from .layout import decode
+from .layout import scalar
+from .layout import scalar_kind
+from .layout import split_array
+from .layout import textual
+from .varobjs import FrameKey
+from .varobjs import Varobj
+from .varobjs import VarobjCache
+
+AGENT = Path(__file__).parent / "agent.py"
+# Elements of an array traced, as many as GDB prints; `Debugger.page` reads
+# the rest
+MAX_ELEMENTS = 200
 
 
 @dataclass(slots=True, frozen=True)
@@ -28,9 +69,177 @@ class Obj:
     type: str
     value: str | Obj
     addr: str | None
+    expanded: bool = True
+    """False for objects a `TracePolicy` cut the trace off at"""
+
+
+@dataclass(slots=True, frozen=True)
+class Page:
+    """Some of the elements of an array, or of the nodes along a chain"""
+
+    start: int
+    items: list[Obj]
+    total: int | None
+    """Elements or nodes in all, if known"""
+
+
+@dataclass(slots=True, frozen=True)
+class TracePolicy:
+    """
+    How much of the memory graph `Debugger.trace` walks. Pointers past these
+    limits are not followed: their targets are traced as unexpanded objects
+    (with a type and an address but no value) that `Debugger.expand` can
+    trace later on.
+    """
+
+    max_nodes: int | None = None
+    """Pointers followed per trace"""
+    max_depth: int | None = None
+    """Pointers followed from a variable to an object"""
+    deadline: float | None = None
+    """Seconds after which no more pointers are followed"""
+    frames: int | None = None
+    """Innermost frames traced"""
+
+    def args(self) -> str:
+        """
+        >>> TracePolicy(max_nodes=100, frames=1).args()
+        '--max-nodes 100 --frames 1'
+        """
+
+        return " ".join(
+            f"--{name.replace('_', '-')} {value}"
+            for name in self.__slots__
+            if (value := getattr(self, name)) is not None
+        )
+
+
+@dataclass(slots=True)
+class MemoStats:
+    hits: int = 0
+    misses: int = 0
 
 
 class Debugger(BaseDebugger):
+    def __init__(
+        self,
+        use_agent: bool = True,
+        trace_policy: TracePolicy = TracePolicy(),
+        checkpoint_interval: int | None = None,
+        max_checkpoints: int = 16,
+        max_record_size: int | None = MAX_RECORD_SIZE,
+    ) -> None:
+        """
+        With `use_agent`, `trace` runs inside GDB (see `agent.py`) whenever
+        this GDB is able to, and over plain MI commands otherwise.
+
+        With `checkpoint_interval`, a GDB checkpoint is taken every that many
+        steps (at most `max_checkpoints` at a time) for `restart` to rewind
+        to.
+
+        A command whose reply is over `max_record_size` bytes (None for no
+        limit) fails with `RecordTooLarge`.
+        """
+
+        super().__init__(max_record_size)
+        self.use_agent = use_agent
+        self.trace_policy = trace_policy
+        self.checkpoint_interval = checkpoint_interval
+        self.max_hw_watchpoints = 4
+        # Conditional breakpoints by (location, condition), disabled while
+        # not in use so that they can be reused
+        self.conditions = dict[tuple[str, str], int]()
+        self.max_checkpoints = max_checkpoints
+        self.checkpoints: Checkpoints | None = None
+        self.exec_log = list[Callable[[], Awaitable[dict]]]()
+        self.fork: int | None = None
+        # Set while steps are being redone, whose output was already seen
+        self.replaying = False
+        self.agent = False
+        self.tracking_allocations = False
+        self.heap_index = HeapIndex()
+        self.varobj_cache = VarobjCache()
+        self.layouts = dict[str, Layout | None]()
+        self.memo = dict[tuple, Future]()
+        self.memo_stats = MemoStats()
+
+    async def init(
+        self, executable_path: str | Path | None = None
+    ) -> Debugger:
+        await super().init()
+        if self.use_agent:
+            await self.load_agent()
+        if executable_path is not None:
+            await self.load(executable_path)
+        return self
+
+    async def load_agent(self) -> bool:
+        """Source the in-GDB trace agent, if this GDB can run it"""
+
+        try:
+            await self.run_command(
+                f'-interpreter-exec console "source {AGENT}"'
+            )
+            res = await self.run_command("-info-gdb-mi-command structs-trace")
+        except ValueError as e:
+            warning(f"cannot load the trace agent, tracing over MI: {e}")
+            self.agent = False
+        else:
+            self.agent = res["command"]["exists"] == "true"
+            if not self.agent:
+                warning(
+                    "this GDB cannot run the trace agent (GDB 13+ with "
+                    "Python is needed), tracing over MI"
+                )
+        return self.agent
+
+    async def track_allocations(self) -> bool:
+        """
+        Have the agent record every block the program allocates and frees
+        from now on (see `allocations`), if it is loaded and this GDB knows
+        how to read call arguments on this architecture
+        """
+
+        if not self.agent:
+            return False
+        functions = " ".join(await self.functions())
+        try:
+            await self.run_command(f"-structs-track-allocations {functions}")
+        except ValueError as e:
+            warning(f"cannot track allocations: {e}")
+            return False
+        self.tracking_allocations = True
+        return True
+
+    async def allocations(self) -> dict[str, Allocation] | None:
+        """
+        Live heap blocks by address, or None unless `track_allocations`
+        """
+
+        if not self.tracking_allocations:
+            return None
+
+        async def query():
+            res = await self.run_command("-structs-allocations")
+            blocks = {
+                addr: Allocation(addr, int(size), int(line), int(step))
+                for addr, size, line, step in res["blocks"]
+            }
+            self.heap_index.sync(blocks)
+            return blocks
+
+        return dict(await self._memoized(("allocations",), query))
+
+    async def resolve(self, addr: int | str) -> tuple[Allocation, int] | None:
+        """
+        The live heap block `addr` points into, and how far into it, or
+        None if it points anywhere else (or allocations are not tracked)
+        """
+
+        if await self.allocations() is None:
+            return None
+        return self.heap_index.find(addr)
+
     async def functions(self) -> list[str]:
         """Do not call while the inferior process is running"""
 
@@ -41,150 +250,1120 @@ class Debugger(BaseDebugger):
             for sym in file["symbols"]
         ]
 
-    async def breakpoint(self, function: str) -> int:
-        res = await self.run_command(f"-break-insert {function}")
+    async def breakpoint(
+        self, location: str, condition: str | None = None
+    ) -> int:
+        """
+        Break at `location` (a function, or "file.c:12"), only when the C
+        expression `condition` holds if there is one. GDB evaluates it
+        itself, without stopping the program otherwise.
+        """
+
+        if condition is None:
+            res = await self.run_command(f"-break-insert {location}")
+        else:
+            res = await self.run_command(
+                f"-break-insert -c {_quote(condition)} {location}"
+            )
         return int(res["bkpt"]["number"])
 
-    async def run(self) -> None:
-        await self.run_command("-exec-run")
+    async def function_lines(self) -> list[str]:
+        """Locations ("file.c:12") of the lines of the current function"""
+
+        async def query():
+            res = await self.run_command("-data-disassemble -a $pc -- 1")
+            return [
+                f"{line['fullname']}:{line['line']}"
+                for line in res["asm_insns"]
+                if line.get("line_asm_insn")
+            ]
+
+        return list(await self._memoized(("function_lines",), query))
+
+    async def run(self) -> dict:
+        stop = await self.run_exec("-exec-run")
+        self.exec_log.clear()
+        if self.checkpoint_interval is not None:
+            self.checkpoints = Checkpoints(
+                self.checkpoint_interval, self.max_checkpoints
+            )
+        await self._checkpoint_if_due()
+        return stop
+
+    @property
+    def step(self) -> int:
+        """Number of steps (`next`, `cont`, `until`, ...) taken since `run`"""
+
+        return len(self.exec_log)
+
+    async def _step(self, action: Callable[[], Awaitable[dict]]) -> dict:
+        """
+        Take a step, logged so that `restart` can take it again. Returns the
+        *stopped record it ended with.
+        """
+
+        if self.tracking_allocations:
+            # For the agent to tell which step each block was allocated in
+            await self.run_command(
+                f"-structs-allocations-step {self.step + 1}"
+            )
+        stop = await action()
+        self.exec_log.append(action)
+        await self._checkpoint_if_due()
+        return stop
+
+    async def _checkpoint_if_due(self) -> None:
+        if self.checkpoints is None or not self.checkpoints.due(self.step):
+            return
+        with suppress(ValueError):
+            # e.g. the program exited
+            id = await self.checkpoint()
+            await self._delete_checkpoints(self.checkpoints.add(self.step, id))
+
+    async def checkpoint(self) -> int:
+        """Fork the inferior, returning the checkpoint's id"""
+
+        output = await self.console("checkpoint")
+        match = search(r"checkpoint (\d+):", output, IGNORECASE)
+        if match is None:
+            raise ValueError(output.strip() or "Cannot take a checkpoint")
+        id = int(match[1])
+        if self.tracking_allocations:
+            await self.run_command(f"-structs-allocations-snapshot save {id}")
+        return id
+
+    async def _delete_checkpoints(self, ids: list[int]) -> None:
+        for id in ids:
+            if id == self.fork:
+                # The process being debugged, deleted once it is left
+                continue
+            with suppress(ValueError):
+                await self.console(f"delete checkpoint {id}")
+            if self.tracking_allocations:
+                await self.run_command(
+                    f"-structs-allocations-snapshot drop {id}"
+                )
+
+    async def restart(self, step: int) -> None:
+        """
+        Bring the inferior back to how it was `step` steps after `run`:
+        switch to the latest checkpoint before then and redo the remaining
+        steps. Checkpoints past `step` are dropped, since the program may
+        now take another path.
+        """
+
+        if not 0 <= step <= self.step:
+            raise ValueError(f"Cannot restart from step {step}")
+        if (
+            self.checkpoints is None
+            or (nearest := self.checkpoints.nearest(step)) is None
+        ):
+            raise ValueError(f"No checkpoint before step {step}")
+        base, id = nearest
+
+        await self.console(f"restart {id}")
+        left, self.fork = self.fork, id
+        if self.tracking_allocations:
+            await self.run_command(
+                f"-structs-allocations-snapshot restore {id}"
+            )
+        # Running on from here consumes checkpoint `id`, so keep a copy
+        copy = await self.checkpoint()
+        stale = self.checkpoints.add(base, copy)
+        stale += self.checkpoints.discard(after=base)
+        if left is not None and left != id:
+            stale.append(left)
+        await self._delete_checkpoints(stale)
+
+        # Console commands do not go through -exec-*, so GDB's state has to
+        # be forgotten explicitly
+        self.invalidate()
+        for varobj in self.varobj_cache.varobjs.values():
+            varobj.fresh = False
+
+        replay = self.exec_log[base:step]
+        del self.exec_log[base:]
+        self.replaying = True
+        try:
+            for action in replay:
+                await self._step(action)
+        finally:
+            self.replaying = False
+
+    def invalidate(self) -> None:
+        """
+        Read-only queries are memoized until the inferior next runs, which
+        is whenever an -exec-* command is sent or GDB reports it running or
+        stopped
+        """
+
+        self.memo.clear()
+
+    async def _memoized[T](
+        self, key: tuple, query: Callable[[], Awaitable[T]]
+    ) -> T:
+        if (future := self.memo.get(key)) is not None:
+            self.memo_stats.hits += 1
+        else:
+            self.memo_stats.misses += 1
+            future = self.memo[key] = create_task(query())
+        return await shield(future)
 
     async def frames(self) -> list[Frame]:
-        res = await self.run_command("-stack-list-frames")
-        return [
-            Frame(frame["func"], frame["file"], int(frame["line"]))
-            for frame in res["stack"]
-        ]
+        async def query():
+            res = await self.run_command("-stack-list-frames")
+            return [
+                Frame(frame["func"], frame["file"], int(frame["line"]))
+                for frame in res["stack"]
+            ]
+
+        return list(await self._memoized(("frames",), query))
+
+    async def next(self) -> dict:
+        return await self._step(partial(self.run_exec, "-exec-next"))
+
+    async def cont(self) -> dict:
+        return await self._step(partial(self.run_exec, "-exec-continue"))
+
+    async def finish(self) -> dict:
+        return await self._step(partial(self.run_exec, "-exec-finish"))
+
+    async def next_n(self, count: int) -> dict:
+        """`count` nexts as one step, stopping early if the program exits"""
+
+        async def action():
+            stop = {}
+            for _ in range(count):
+                stop = await self.run_exec("-exec-next")
+                if _exited(stop):
+                    break
+            return stop
+
+        return await self._step(action)
+
+    async def until(self, *locations: str) -> dict:
+        """
+        Continue until one of `locations` (e.g. "file.c:12") is reached,
+        going past any other breakpoint on the way
+        """
+
+        async def action():
+            results = await self.run_commands(
+                [f"-break-insert -t {location}" for location in locations]
+            )
+            numbers = [int(res["bkpt"]["number"]) for res in results]
+            try:
+                return await self._continue_to(numbers)
+            finally:
+                # The one that was hit is already gone
+                await self.run_commands(
+                    [f"-break-delete {number}" for number in numbers],
+                    return_exceptions=True,
+                )
 
-    async def next(self) -> None:
-        await self.run_command("-exec-next")
+        return await self._step(action)
 
-    async def cont(self) -> None:
-        await self.run_command("-exec-continue")
+    async def _continue_to(self, numbers: Collection[int]) -> dict:
+        """Continue until one of the breakpoints `numbers` is hit"""
 
-    async def finish(self) -> None:
-        await self.run_command("-exec-finish")
+        while True:
+            stop = await self.run_exec("-exec-continue")
+            if (
+                stop.get("reason") != "breakpoint-hit"
+                or int(stop["bkptno"]) in numbers
+            ):
+                return stop
+
+    async def capture(
+        self, locations: list[str], max_hits: int = 1000
+    ) -> AsyncIterator[tuple[dict, tuple]]:
+        """
+        Run the program on, stopping at each of `locations` (functions or
+        "file.c:12") until it exits, and yield the *stopped record and the
+        `trace` of every stop. Each stop is one step.
+        """
+
+        async for stop, trace in self.steps(
+            lambda debugger: debugger.until(*locations), max_steps=max_hits
+        ):
+            yield stop, trace
+
+    async def steps(
+        self,
+        step: Callable[[Debugger], Awaitable[dict]] | None = None,
+        policy: TracePolicy | None = None,
+        queue_size: int = 4,
+        max_steps: int | None = None,
+        legacy: bool = False,
+    ) -> AsyncIterator[tuple[dict, tuple]]:
+        """
+        Take `step` (`next` by default) after `step` until the program
+        exits, or `max_steps` times, yielding the *stopped record and the
+        `trace` (or `legacy_trace`) of each stop. Stepping runs ahead of the
+        consumer by up to `queue_size` states, so that it overlaps with
+        whatever the consumer does with them.
+
+        Nothing else may use the debugger until the iteration is over. To
+        stop early, close the iterator (e.g. with `contextlib.aclosing`),
+        which waits for the step in flight.
+        """
+
+        trace = self.legacy_trace if legacy else self.trace
+        queue = Queue[tuple[dict, tuple] | BaseException | None](queue_size)
+        stopping = False
+
+        async def produce():
+            try:
+                taken = 0
+                while not stopping and taken != max_steps:
+                    stop = await (self.next() if step is None else step(self))
+                    taken += 1
+                    if _exited(stop):
+                        break
+                    await queue.put((stop, await trace(policy)))
+            except Exception as e:
+                await queue.put(e)
+            finally:
+                await queue.put(None)
+
+        producer = create_task(produce())
+        try:
+            while (item := await queue.get()) is not None:
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            # Let the step in flight finish, so that `step` stays accurate
+            stopping = True
+            while not producer.done():
+                # Make room for whatever it is waiting to put
+                getter = create_task(queue.get())
+                await wait([producer, getter], return_when=FIRST_COMPLETED)
+                getter.cancel()
+
+    async def until_true(self, condition: str) -> dict:
+        """
+        Continue until the C expression `condition` holds on some line of
+        the current function, going past any other breakpoint on the way.
+        GDB tests it at each line with conditional breakpoints, so the
+        program runs without a round trip per line.
+        """
+
+        async def action():
+            lines = await self.function_lines()
+            missing = [
+                line
+                for line in lines
+                if (line, condition) not in self.conditions
+            ]
+            results = await gather(
+                *(self.breakpoint(line, condition) for line in missing),
+                return_exceptions=True,
+            )
+            numbers = [n for n in results if not isinstance(n, BaseException)]
+            self.conditions.update(
+                ((line, condition), number)
+                for line, number in zip(missing, results)
+                if number in numbers
+            )
+            if len(numbers) < len(results):
+                # Keep the ones that were inserted for next time, disabled
+                if numbers:
+                    await self.run_command(
+                        f"-break-disable {_numbers(numbers)}"
+                    )
+                raise next(e for e in results if isinstance(e, BaseException))
+            ours = [self.conditions[line, condition] for line in lines]
+            reused = [number for number in ours if number not in numbers]
+            if reused:
+                await self.run_command(f"-break-enable {_numbers(reused)}")
+            try:
+                return await self._continue_to(ours)
+            finally:
+                await self.run_command(f"-break-disable {_numbers(ours)}")
+
+        return await self._step(action)
+
+    async def watch_until(self, objects: list[tuple[str, str]]) -> dict:
+        """
+        Continue until any of `objects` ((address, type) pairs) changes.
+        The first `max_hw_watchpoints` are watched in hardware, the rest in
+        software (much slower, as GDB then single-steps the program), and
+        all of them in software if GDB fails to insert them in hardware.
+        """
+
+        async def watch(objects: list[tuple[str, str]], hardware: bool):
+            await self.run_command(
+                f"-gdb-set can-use-hw-watchpoints {int(hardware)}"
+            )
+            results = await self.run_commands(
+                [
+                    f"-break-watch {_quote(f'*({type} *) {addr}')}"
+                    for addr, type in objects
+                ]
+            )
+            return [res["wpt"]["number"] for res in results]
+
+        async def action():
+            numbers = list[str]()
+            try:
+                hardware = objects[: self.max_hw_watchpoints]
+                numbers += await watch(hardware, True)
+                numbers += await watch(objects[len(hardware) :], False)
+                while True:
+                    try:
+                        stop = await self.run_exec("-exec-continue")
+                    except ValueError as e:
+                        if "hardware" not in str(e) or not hardware:
+                            raise
+                        # Too many or too large for the debug registers
+                        await self.run_commands(
+                            [f"-break-delete {number}" for number in numbers]
+                        )
+                        numbers, hardware = [], []
+                        numbers += await watch(objects, False)
+                        continue
+                    if stop.get("reason") != "breakpoint-hit":
+                        return stop
+            finally:
+                await self.run_command("-gdb-set can-use-hw-watchpoints 1")
+                await self.run_commands(
+                    [f"-break-delete {number}" for number in numbers],
+                    return_exceptions=True,
+                )
+
+        return await self._step(action)
+
+    async def step_out(self) -> dict:
+        """
+        Run until the current function returns, going past any breakpoint
+        in the functions it calls
+        """
+
+        async def action():
+            depth = len(await self.frames())
+            while True:
+                stop = await self.run_exec("-exec-finish")
+                if _exited(stop) or len(await self.frames()) < depth:
+                    return stop
+
+        return await self._step(action)
 
     async def variables(self, frame: int = 0) -> dict[str, str]:
-        res = await self.run_command(
-            f"-stack-list-variables --thread 1 --frame {frame} --all-values"
-        )
-        return {local["name"]: local["value"] for local in res["variables"]}
+        async def query():
+            res = await self.run_command(
+                "-stack-list-variables "
+                f"--thread 1 --frame {frame} --all-values"
+            )
+            return {
+                local["name"]: local["value"] for local in res["variables"]
+            }
+
+        return dict(await self._memoized(("variables", frame), query))
+
+    async def evaluate(self, expr: str, frame: int = 0) -> str:
+        async def query():
+            res = await self.run_command(
+                "-data-evaluate-expression "
+                f"--thread 1 --frame {frame} {_quote(expr)}"
+            )
+            return res["value"]
+
+        return await self._memoized(("evaluate", frame, expr), query)
 
     async def var_details(
         self, var: str, frame: int = 0
     ) -> tuple[str, str | dict, str, list[tuple[str, str]]]:
-        await self.run_command(f"-stack-select-frame {frame}")
+        (details,) = await self.vars_details([var], frame)
+        if isinstance(details, ValueError):
+            raise details
+        return details
 
-        await self.run_command(f"-var-create VARIABLE * {var}")
-        res = await self.run_command(f"-var-info-type VARIABLE")
-        type = res["type"]
+    async def vars_details(
+        self, vars: list[str], frame: int = 0
+    ) -> list[tuple[str, str | dict, str, list[tuple[str, str]]] | ValueError]:
+        """
+        Type, value, address and children of every expression in `vars`,
+        evaluated in `frame`, fetched in a single round trip. Expressions
+        that GDB cannot evaluate map to the `ValueError` it raised.
+        """
 
-        res = await self.run_command("-var-list-children VARIABLE")
-        childs = (
-            [(c["exp"], c["type"]) for c in res["children"]]
-            if res["numchild"] != "0"
-            else []
-        )
-        await self.run_command("-var-delete VARIABLE")
+        futures = dict[str, Future]()
+        missing = list[str]()
+        for var in vars:
+            if var in futures:
+                continue
+            future = self.memo.get(("details", frame, var))
+            if future is None:
+                future = get_running_loop().create_future()
+                self.memo[("details", frame, var)] = future
+                missing.append(var)
+            futures[var] = future
+        self.memo_stats.hits += len(futures) - len(missing)
+        self.memo_stats.misses += len(missing)
+
+        if missing:
+            try:
+                details = await self._vars_details(missing, frame)
+            except BaseException:
+                for var in missing:
+                    self.memo.pop(("details", frame, var), None)
+                    futures[var].cancel()
+                raise
+            for var, res in zip(missing, details):
+                futures[var].set_result(res)
+
+        return [await shield(futures[var]) for var in vars]
+
+    async def _vars_details(
+        self, vars: list[str], frame: int
+    ) -> list[tuple[str, str | dict, str, list[tuple[str, str]]] | ValueError]:
+        if self.agent:
+            try:
+                return await self._agent_vars_details(vars, frame)
+            except ValueError as e:
+                warning(f"agent describe failed, reading over MI: {e}")
+        context = f"--thread 1 --frame {frame}"
+        commands = list[str]()
+        for var in vars:
+            name = f"var{next(self.tokens)}"
+            commands += [
+                f"-var-create {context} {name} * {_quote(var)}",
+                f"-var-list-children {name} 0 {MAX_ELEMENTS}",
+                f"-var-delete {name}",
+                f"-data-evaluate-expression {context} {_quote(var)}",
+                f"-data-evaluate-expression {context} {_quote('&' + var)}",
+            ]
+        results = await self.run_commands(commands, return_exceptions=True)
+
+        details = list[tuple | ValueError]()
+        for i in range(0, len(results), 5):
+            batch = results[i : i + 5]
+            if error := _first_error(batch):
+                details.append(error)
+                continue
+            res_var, res_children, _, res_value, res_address = batch
+            details.append(
+                (
+                    res_var["type"],
+                    _value(res_value["value"]),
+                    _address(res_address),
+                    _children(res_children),
+                )
+            )
+        return details
 
-        res = await self.run_command(f"-data-evaluate-expression {var}")
-        value = res["value"]
-        with suppress(JSONDecodeError):
-            value = mion.valueloads(res["value"])
+    async def _agent_vars_details(
+        self, vars: list[str], frame: int
+    ) -> list[tuple[str, str | dict, str, list[tuple[str, str]]] | ValueError]:
+        """`_vars_details` in one command to the agent, however many `vars`"""
 
-        res = await self.run_command(f"-data-evaluate-expression &{var}")
-        address = res["value"].split(" ", 1)[0]
+        res = await self.run_command(
+            f"-structs-describe {frame} " + " ".join(map(_quote, vars))
+        )
+        details = list[tuple | ValueError]()
+        for described in loads(bytes.fromhex(res["details"])):
+            if isinstance(described, dict):
+                details.append(ValueError(described["error"]))
+                continue
+            type, value, addr, childs = described
+            details.append(
+                (type, _value(value), addr, list(map(tuple, childs)))
+            )
+        return details
 
-        await self.run_command(f"-stack-select-frame 0")
-        return (type, value, address, childs)
+    async def tracked_details(
+        self, vars: list[str], frame: int, frame_key: FrameKey
+    ) -> list[tuple[str, str | dict, str, list[tuple[str, str]]] | ValueError]:
+        """
+        Same as `vars_details`, but backed by varobjs that live for the whole
+        session. Expressions that `update_varobjs` has not reported as
+        changed since they were last read cost no MI traffic at all.
+        """
+
+        context = f"--thread 1 --frame {frame}"
+        commands = list[str]()
+        stale = dict[str, str | None]()
+        for var in vars:
+            varobj = self.varobj_cache.get((frame_key, var))
+            if var in stale or (varobj is not None and varobj.fresh):
+                continue
+            if varobj is None:
+                name = stale[var] = f"var{next(self.tokens)}"
+                commands += [
+                    f"-var-create {context} {name} * {_quote(var)}",
+                    f"-var-list-children {name} 0 {MAX_ELEMENTS}",
+                ]
+            else:
+                stale[var] = None
+            commands += [
+                f"-data-evaluate-expression {context} {_quote(var)}",
+                f"-data-evaluate-expression {context} {_quote('&' + var)}",
+            ]
+        results = iter(
+            await self.run_commands(commands, return_exceptions=True)
+        )
 
-    async def trace(self):
-        def follow(var: str, type: str, children: list[tuple[str, str]]):
-            queue = list[str]()
-            for subname, subtype in children:
-                if subtype == "char":
-                    # Avoid insepcting each char in each string
+        errors = dict[str, ValueError]()
+        for var, name in stale.items():
+            key = (frame_key, var)
+            if name is not None:
+                res_var, res_children = next(results), next(results)
+                if error := _first_error([res_var]):
+                    next(results), next(results)
+                    errors[var] = error
                     continue
-                if subname.startswith("*"):
-                    # It is a pointer
-                    queue.append(subname)
-                elif subname.isdigit():
-                    # It is an array index
-                    queue.append(f"{var}[{subname}]")
-                elif type.endswith("*"):
-                    # It is a struct pointer
-                    queue.append(f"(*{var})")
-                else:
-                    # It is a struct field
-                    queue.append(f"({var}.{subname})")
-            return queue
+                children = [] if _first_error([res_children]) else res_children
+                self.varobj_cache.add(
+                    key, Varobj(name, res_var["type"], _children(children))
+                )
+
+            res_value, res_address = next(results), next(results)
+            if error := _first_error([res_value, res_address]):
+                errors[var] = error
+                continue
+            varobj = self.varobj_cache.get(key)
+            varobj.value = _value(res_value["value"])
+            varobj.addr = _address(res_address)
+            varobj.fresh = True
+
+        details = list[tuple | ValueError]()
+        for var in vars:
+            if var in errors:
+                details.append(errors[var])
+                continue
+            varobj = self.varobj_cache.get((frame_key, var))
+            details.append(
+                (varobj.type, varobj.value, varobj.addr, varobj.children)
+            )
+        return details
+
+    async def update_varobjs(self) -> None:
+        """
+        Ask GDB which session varobjs changed since the last call, and mark
+        those (and the expressions traced through them) as stale. Varobjs
+        whose frame is gone are deleted.
+        """
+
+        if not self.varobj_cache.varobjs:
+            return
+
+        res = await self.run_command("-var-update --all-values *")
+        dead = list[str]()
+        for change in res["changelist"]:
+            key = self.varobj_cache.key(change["name"])
+            if key is None:
+                continue
+            self.varobj_cache.invalidate(key)
+            if (
+                change.get("in_scope", "true") != "true"
+                or change.get("type_changed") == "true"
+            ):
+                dead.append(self.varobj_cache.remove(key).name)
+
+        await self.run_commands(
+            [f"-var-delete {name}" for name in dead], return_exceptions=True
+        )
+
+    async def trace(self, policy: TracePolicy | None = None):
+        policy = policy or self.trace_policy
+
+        async def query():
+            if self.agent:
+                try:
+                    return await self.agent_trace(policy)
+                except ValueError as e:
+                    # A bug in the agent, most likely, so do not hide it
+                    warning(f"agent trace failed, tracing over MI: {e}")
+            return await self.mi_trace(policy)
+
+        return await self._memoized(("trace", policy), query)
+
+    async def expand(
+        self, addr: str, type: str, policy: TracePolicy | None = None
+    ) -> tuple[dict[tuple[str, str], Obj], dict[str, list[tuple[str, str]]]]:
+        """
+        Trace from an object `trace` left unexpanded, within a fresh budget
+        """
+
+        policy = policy or self.trace_policy
+
+        async def query():
+            if self.agent:
+                try:
+                    _, addresses, structs = await self.agent_trace(
+                        policy, f"--expand {addr} {_quote(type)}"
+                    )
+                    return addresses, structs
+                except ValueError as e:
+                    warning(f"agent expand failed, expanding over MI: {e}")
+
+            addresses: dict[tuple[str, str], Obj] = {}
+            structs: dict[str, list[tuple[str, str]]] = {}  # legacy
+            stack = await self.frames()
+            key = (len(stack) - 1, stack[0].func)
+            root = _Pending(None, f"(*({type} *) {addr})", 0, (type, addr))
+            await self._walk([root], 0, key, addresses, structs, policy)
+            return addresses, structs
+
+        return await self._memoized(("expand", addr, type, policy), query)
+
+    async def agent_trace(self, policy: TracePolicy, args: str = ""):
+        """`trace`, in a single round trip to the in-GDB agent"""
+
+        res = await self.run_command(
+            f"-structs-trace {policy.args()} {args}".strip()
+        )
+        doc = loads(bytes.fromhex(res["trace"]))
 
         frames = list[FullFrame]()
         addresses: dict[tuple[str, str], Obj] = {}
         structs: dict[str, list[tuple[str, str]]] = {}  # legacy
 
-        for i, frame in enumerate(await self.frames()):
-            queue = deque()
+        for frame in doc["frames"]:
+            vars = dict[str, Obj]()
+            for var, (type, value, addr, childs) in frame["vars"].items():
+                value = _value(value)
+                childs = list(map(tuple, childs))
+                vars[var] = Obj(type, value, addr)
+                addresses[addr, type] = Obj(type, value, addr)
+                if childs and not type.endswith("*"):
+                    structs[type] = childs
+            frames.append(
+                FullFrame(
+                    Frame(frame["func"], frame["file"], frame["line"]), vars
+                )
+            )
+
+        for type, value, addr, childs in doc["objects"]:
+            childs = list(map(tuple, childs))
+            _record(addresses, structs, type, _value(value), addr, childs)
+        for type, addr in doc["stubs"]:
+            addresses.setdefault((addr, type), Obj(type, None, addr, False))
+
+        return frames, addresses, structs
+
+    async def mi_trace(self, policy: TracePolicy):
+        """`trace`, over plain MI commands"""
+
+        frames = list[FullFrame]()
+        addresses: dict[tuple[str, str], Obj] = {}
+        structs: dict[str, list[tuple[str, str]]] = {}  # legacy
+        budget = _Budget(policy)
+
+        await self.update_varobjs()
+        stack = await self.frames()
+        traced = stack[: policy.frames]
+        stack_vars = await gather(*map(self.variables, range(len(traced))))
+        for i, (frame, names) in enumerate(zip(traced, map(list, stack_vars))):
+            key = (len(stack) - 1 - i, frame.func)
 
             vars = dict[str, Obj]()
-            for var in await self.variables(i):
-                type, value, addr, childs = await self.var_details(var, i)
+            expand = list[_Expandable]()
+            details = await self.tracked_details(names, i, key)
+            for var, res in zip(names, details):
+                if isinstance(res, ValueError):
+                    raise res
+                type, value, addr, childs = res
                 vars[var] = Obj(type, value, addr)
                 addresses[addr, type] = Obj(type, value, addr)
                 if childs and not type.endswith("*"):
                     structs[type] = childs
                 if value != "0x0" and type != "void *":
-                    queue.extend(follow(var, type, childs))
+                    expand.append(
+                        _Expandable(var, type, value, addr, childs, 0)
+                    )
             frames.append(FullFrame(frame, vars))
 
-            while queue:
-                var = queue.popleft()
-                try:
-                    type, value, addr, childs = await self.var_details(var, i)
-                except ValueError:
+            queue = await self._expand(expand, addresses, structs)
+            await self._walk(queue, i, key, addresses, structs, budget)
+
+        return frames, addresses, structs
+
+    async def _walk(
+        self,
+        queue: list[_Pending],
+        frame: int,
+        key: FrameKey,
+        addresses: dict[tuple[str, str], Obj],
+        structs: dict[str, list[tuple[str, str]]],
+        budget: TracePolicy | _Budget,
+    ) -> None:
+        """Breadth-first, one pipelined batch per level"""
+
+        if isinstance(budget, TracePolicy):
+            budget = _Budget(budget)
+
+        while queue:
+            level = list[_Pending]()
+            for pending in queue:
+                if pending.pointee is None:
+                    level.append(pending)
                     continue
+                type, addr = pending.pointee
                 if (addr, type) in addresses:
+                    # Already traced, or left unexpanded
                     continue
-                addresses[addr, type] = Obj(type, value, addr)
-                if (
-                    childs
-                    and not type.endswith("*")
-                    and not type.endswith("[]")
-                ):
-                    try:
-                        structs[type] = childs
-                        addresses[addr, type] = Obj(
+                if budget.admit(pending.depth):
+                    level.append(pending)
+                else:
+                    addresses[addr, type] = Obj(type, None, addr, False)
+
+            expand = list[_Expandable]()
+            exprs = [pending.expr for pending in level]
+            details = await self.tracked_details(exprs, frame, key)
+            for pending, res in zip(level, details):
+                if pending.parent is not None:
+                    self.varobj_cache.link(
+                        (key, pending.parent), (key, pending.expr)
+                    )
+                if isinstance(res, ValueError):
+                    continue
+                type, value, addr, childs = res
+                if not _record(addresses, structs, type, value, addr, childs):
+                    continue
+                if value != "0x0" and type != "void *":
+                    expand.append(
+                        _Expandable(
+                            pending.expr,
                             type,
-                            {
-                                name: Obj(type, value[name], None)
-                                for name, type in childs
-                            },
-                            addr,
-                        )  # legacy
-                    except Exception:
-                        assert False, (
-                            [(name, type) for name, type in childs],
                             value,
+                            addr,
+                            childs,
+                            pending.depth,
                         )
-                if value != "0x0" and type != "void *":
-                    queue.extend(follow(var, type, childs))
+                    )
+            queue = await self._expand(expand, addresses, structs)
 
-        return frames, addresses, structs
+    async def _expand(
+        self,
+        objects: list[_Expandable],
+        addresses: dict[tuple[str, str], Obj],
+        structs: dict[str, list[tuple[str, str]]],
+    ) -> list[_Pending]:
+        """
+        What to trace after `objects`. Structs and arrays with a known
+        layout are read in one go and their fields or elements recorded
+        straight away, so only the pointers among them are left to follow.
+        """
 
-    async def legacy_trace(self):
-        frame = (await self.frames())[0]
-        frames, memory, types = await self.trace()
-
-        legacy_types = [
-            {
-                "typeName": name,
-                "fields": [
-                    {"name": name, "typeName": type} for name, type in childs
-                ],
-            }
-            for name, childs in types.items()
+        aggregates = [
+            obj
+            for obj in objects
+            if not obj.type.endswith("*")
+            and any(subtype != "char" for _, subtype in obj.childs)
         ]
+        layouts = await gather(
+            *(self.type_layout(obj.type, obj.childs) for obj in aggregates)
+        )
+        reads = {
+            obj.var: (_bounded(layout), obj.addr)
+            for obj, layout in zip(aggregates, layouts)
+            if layout is not None
+        }
+        datas = await gather(
+            *(
+                self.read_memory(addr, layout.size)
+                for layout, addr in reads.values()
+            ),
+            return_exceptions=True,
+        )
+        for var, data in zip(list(reads), datas):
+            if isinstance(data, ValueError):
+                del reads[var]
+            elif isinstance(data, BaseException):
+                raise data
+            else:
+                reads[var] += (data,)
+
+        queue = list[_Pending]()
+        for obj in objects:
+            if obj.var not in reads:
+                queue.extend(_follow(obj))
+                continue
+
+            layout, addr, data = reads[obj.var]
+            base = int(addr, 16)
+            pending = [(obj.var, layout, base)]
+            while pending:
+                expr, layout, addr = pending.pop(0)
+                for name, child, child_addr in children(
+                    _bounded(layout), addr
+                ):
+                    if child.type == "char":
+                        # Avoid insepcting each char in each string
+                        continue
+                    child_expr = (
+                        f"({expr}.{name})"
+                        if layout.kind == STRUCT
+                        else f"{expr}[{name}]"
+                    )
+                    value = decode(child, data, child_addr - base)
+                    fields = [(f.name, f.layout.type) for f in child.fields]
+                    if not _record(
+                        addresses,
+                        structs,
+                        child.type,
+                        value,
+                        hex(child_addr),
+                        fields,
+                    ):
+                        continue
+                    if child.kind in (STRUCT, ARRAY):
+                        pending.append((child_expr, child, child_addr))
+                    elif (
+                        child.kind == POINTER
+                        and value != "0x0"
+                        and child.type not in ("void *", "char *")
+                    ):
+                        queue.append(
+                            _Pending(
+                                obj.var,
+                                f"(*{child_expr})",
+                                obj.depth + 1,
+                                (_pointee(child.type), value),
+                            )
+                        )
+        return queue
+
+    async def type_layout(
+        self, type: str, childs: list[tuple[str, str]] = ()
+    ) -> Layout | None:
+        """
+        Memory layout of `type`, or None if it cannot be decoded locally.
+        Structs are only laid out given their `-var-list-children` fields.
+        """
+
+        if type in self.layouts:
+            return self.layouts[type]
+
+        if textual(type):
+            # Left to GDB, so that both paths give the same strings
+            layout = None
+        elif array := split_array(type):
+            element_type, length = array
+            element = await self.type_layout(element_type)
+            layout = element and Layout(
+                type, ARRAY, element.size * length, (), element, length
+            )
+        elif scalar_kind(type):
+            try:
+                res = await self.run_command(
+                    f'-data-evaluate-expression "sizeof({type})"'
+                )
+            except ValueError:
+                layout = None
+            else:
+                layout = scalar(type, int(res["value"]))
+        elif childs and not type.endswith("*"):
+            field_layouts = await gather(
+                *(self.type_layout(field_type) for _, field_type in childs)
+            )
+            if None in field_layouts:
+                return None
+            try:
+                res_size, *res_offsets = await self.run_commands(
+                    [f'-data-evaluate-expression "sizeof({type})"']
+                    + [
+                        "-data-evaluate-expression "
+                        f'"(unsigned long) &(({type} *) 0)->{name}"'
+                        for name, _ in childs
+                    ]
+                )
+            except ValueError:
+                # e.g. anonymous members, which cannot be named
+                layout = None
+            else:
+                fields = tuple(
+                    Field(name, int(res["value"]), field_layout)
+                    for (name, _), res, field_layout in zip(
+                        childs, res_offsets, field_layouts
+                    )
+                )
+                layout = Layout(type, STRUCT, int(res_size["value"]), fields)
+        else:
+            return None
+
+        self.layouts[type] = layout
+        return layout
+
+    async def read_memory(self, addr: int | str, size: int) -> bytes:
+        res = await self.run_command(f"-data-read-memory-bytes {addr} {size}")
+        data = b"".join(
+            bytes.fromhex(block["contents"]) for block in res["memory"]
+        )
+        if len(data) != size:
+            raise ValueError(f"Cannot access memory at address {addr}")
+        return data
+
+    async def read_array(self, addr: int | str, type: str, count: int) -> list:
+        """
+        `count` contiguous `type`s starting at `addr` (e.g. a heap array),
+        in a single memory read
+        """
+
+        element = await self.type_layout(type)
+        if element is None:
+            raise ValueError(f"Cannot decode values of type {type}")
+        layout = Layout(
+            f"{type} [{count}]",
+            ARRAY,
+            element.size * count,
+            (),
+            element,
+            count,
+        )
+        return decode(layout, await self.read_memory(addr, layout.size))
+
+    async def page(
+        self,
+        addr: str,
+        type: str,
+        start: int,
+        count: int,
+        link: str | None = None,
+    ) -> Page:
+        """
+        `count` elements from index `start` of the `type` array at `addr`,
+        or, for a pointer `type`, of the array of its pointees that starts
+        at `addr` (bounded by the heap block it is in, if known). For a
+        struct `type`, `count` nodes from `start` hops along the chain that
+        starts at `addr`, following its `link` field (by default, the first
+        pointer to its own type). Pages hold at most `MAX_ELEMENTS` items.
+        """
+
+        count = min(count, MAX_ELEMENTS)
+
+        async def query():
+            if split_array(type) or type.endswith("*"):
+                return await self._array_page(addr, type, start, count)
+            return await self._chain_page(addr, type, start, count, link)
+
+        return await self._memoized(
+            ("page", addr, type, start, count, link), query
+        )
+
+    async def _array_page(
+        self, addr: str, type: str, start: int, count: int
+    ) -> Page:
+        if array := split_array(type):
+            element_type, total = array
+        else:
+            element_type, total = _pointee(type), None
+            with suppress(ValueError):
+                if found := await self.resolve(addr):
+                    block, offset = found
+                    total = (block.size - offset) // (
+                        await self._sizeof(element_type)
+                    )
+        start = max(start, 0)
+        end = start + max(count, 0)
+        if total is not None:
+            start, end = min(start, total), min(end, total)
+        if start == end:
+            return Page(start, [], total)
+
+        element = await self._element_layout(addr, element_type)
+        base = int(addr, 16)
+        if element is not None:
+            # The whole page in one read
+            layout = Layout(
+                f"{element_type} [{end - start}]",
+                ARRAY,
+                element.size * (end - start),
+                (),
+                element,
+                end - start,
+            )
+            data = await self.read_memory(
+                hex(base + start * element.size), layout.size
+            )
+            values = decode(layout, data)
+            size = element.size
+        else:
+            # GDB prints at most 200 elements of an array by default
+            commands = [
+                "-data-evaluate-expression "
+                + _quote(
+                    f"(({element_type} *) {addr})[{i}]@{min(200, end - i)}"
+                )
+                for i in range(start, end, 200)
+            ]
+            values = list[any]()
+            for res in await self.run_commands(commands):
+                value = _value(res["value"])
+                values += value if isinstance(value, list) else [value]
+            size = await self._sizeof(element_type)
+        items = [
+            Obj(element_type, value, hex(base + (start + i) * size))
+            for i, value in enumerate(values)
+        ]
+        return Page(start, items, total)
+
+    async def _chain_page(
+        self, addr: str, type: str, start: int, count: int, link: str | None
+    ) -> Page:
+        items = list[Obj]()
+        seen = set[str]()
+        layout = None
+        node = addr
+        hops = 0
+        while node != "0x0" and node not in seen and hops < start + count:
+            seen.add(node)
+            if layout is not None:
+                value = decode(
+                    layout, await self.read_memory(node, layout.size)
+                )
+            else:
+                _, value, _, childs = await self.var_details(
+                    f"(*({type} *) {node})"
+                )
+                if link is None:
+                    links = [
+                        name
+                        for name, subtype in childs
+                        if _pointee(subtype) == type
+                    ]
+                    if not links:
+                        raise ValueError(f"{type} does not link to another")
+                    link = links[0]
+                # Later nodes are read straight from memory, if possible
+                layout = await self.type_layout(type, childs)
+            if not isinstance(value, dict):
+                raise ValueError(f"Cannot read the {type} at {node}")
+            if link not in value:
+                raise ValueError(f"{type} has no field {link}")
+            if hops >= start:
+                items.append(Obj(type, value, node))
+            node = value[link]
+            hops += 1
+        # Unknown unless the walk got to the end (whereas cycles have none)
+        total = hops if node == "0x0" else None
+        return Page(start, items, total)
+
+    async def _element_layout(self, addr: str, type: str) -> Layout | None:
+        if type in self.layouts or split_array(type) or scalar_kind(type):
+            return await self.type_layout(type)
+        try:
+            _, _, _, childs = await self.var_details(f"(*({type} *) {addr})")
+        except ValueError:
+            return None
+        return await self.type_layout(type, childs)
+
+    async def _sizeof(self, type: str) -> int:
+        res = await self.run_command(
+            f'-data-evaluate-expression "sizeof({type})"'
+        )
+        return int(res["value"])
+
+    async def legacy_trace(self, policy: TracePolicy | None = None):
+        frame = (await self.frames())[0]
+        (frames, memory, types), heap = await gather(
+            self.trace(policy), self.allocations()
+        )
+        index = None if heap is None else self.heap_index
 
+        legacy_types = _legacy_types(types)
         legacy_mem = {
             "frame_info": {
                 "file": frame.file,
@@ -193,15 +1372,258 @@ class Debugger(BaseDebugger):
             },
             "stack_data": {
                 name: {"addr": o.addr, "typeName": o.type, "value": o.value}
+                | (
+                    _legacy_target(index, o.value)
+                    if o.type.endswith("*")
+                    else {}
+                )
                 for name, o in frames[0].vars.items()
             },
-            "heap_data": {
-                addr: {"addr": addr, "typeName": o.type, "value": o.value}
-                for (addr, _), o in reversed(memory.items())
-                if "*" not in o.type
-                and "struct" in o.type
-                and not o.addr.startswith("0xffff")
-            },
+            "heap_data": _legacy_heap(memory, index),
         }
 
         return legacy_types, legacy_mem
+
+    async def legacy_expand(self, addr: str, type: str):
+        (memory, types), heap = await gather(
+            self.expand(addr, type), self.allocations()
+        )
+        index = None if heap is None else self.heap_index
+        return _legacy_types(types), _legacy_heap(memory, index)
+
+
+@dataclass(slots=True, frozen=True)
+class _Expandable:
+    """A traced object whose children are still to be traced"""
+
+    var: str
+    type: str
+    value: str | dict
+    addr: str
+    childs: list[tuple[str, str]]
+    depth: int
+
+
+@dataclass(slots=True, frozen=True)
+class _Pending:
+    """An expression to trace, reached from `parent`"""
+
+    parent: str | None
+    expr: str
+    depth: int
+    pointee: tuple[str, str] | None = None
+    """(type, address) when `expr` dereferences a pointer"""
+
+
+@dataclass(slots=True)
+class _Budget:
+    policy: TracePolicy
+    start: float = field(default_factory=monotonic)
+    nodes: int = 0
+
+    def admit(self, depth: int) -> bool:
+        """Whether a pointer leading `depth` pointers deep may be followed"""
+
+        policy = self.policy
+        if (
+            policy.max_depth is not None
+            and depth > policy.max_depth
+            or policy.max_nodes is not None
+            and self.nodes >= policy.max_nodes
+            or policy.deadline is not None
+            and monotonic() - self.start > policy.deadline
+        ):
+            return False
+        self.nodes += 1
+        return True
+
+
+def _follow(obj: _Expandable) -> list[_Pending]:
+    """
+    >>> childs = [("data", "int")]
+    >>> obj = _Expandable("l", "struct node *", "0x10", "0x20", childs, 0)
+    >>> (pending,) = _follow(obj)
+    >>> pending.expr, pending.depth, pending.pointee
+    ('(*l)', 1, ('struct node', '0x10'))
+    """
+
+    if not any(subtype != "char" for _, subtype in obj.childs):
+        # Avoid insepcting each char in each string
+        return []
+    if obj.type.endswith("*"):
+        return [
+            _Pending(
+                obj.var,
+                f"(*{obj.var})",
+                obj.depth + 1,
+                (_pointee(obj.type), str(obj.value).split(" ", 1)[0]),
+            )
+        ]
+
+    queue = list[_Pending]()
+    for subname, subtype in obj.childs:
+        if subtype == "char":
+            continue
+        if subname.isdigit():
+            # It is an array index
+            queue.append(_Pending(obj.var, f"{obj.var}[{subname}]", obj.depth))
+        else:
+            # It is a struct field
+            queue.append(
+                _Pending(obj.var, f"({obj.var}.{subname})", obj.depth)
+            )
+    return queue
+
+
+def _pointee(type: str) -> str:
+    """
+    >>> _pointee("struct node **")
+    'struct node *'
+    """
+
+    return type.removesuffix("*").rstrip()
+
+
+def _quote(expr: str) -> str:
+    """
+    >>> print(_quote('(*(struct node *) 0x10)'))
+    "(*(struct node *) 0x10)"
+    """
+
+    escaped = expr.replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{escaped}"'
+
+
+def _legacy_types(types: dict[str, list[tuple[str, str]]]) -> list[dict]:
+    return [
+        {
+            "typeName": name,
+            "fields": [
+                {"name": name, "typeName": type} for name, type in childs
+            ],
+        }
+        for name, childs in types.items()
+    ]
+
+
+def _legacy_heap(
+    memory: dict[tuple[str, str], Obj], index: HeapIndex | None
+) -> dict[str, dict]:
+    """
+    Structs inside a heap block, or, without a record of the heap blocks,
+    structs that do not look like they are on the stack
+    """
+
+    heap = dict[str, dict]()
+    for (addr, _), o in reversed(memory.items()):
+        if "*" in o.type or "struct" not in o.type:
+            continue
+        if index is None:
+            if o.addr.startswith("0xffff"):
+                continue
+            location = {}
+        elif not (location := _legacy_target(index, o.addr)):
+            continue
+        heap[addr] = (
+            {"addr": addr, "typeName": o.type, "value": o.value}
+            | location
+            | ({} if o.expanded else {"unexpanded": True})
+        )
+    return heap
+
+
+def _legacy_target(index: HeapIndex | None, addr: any) -> dict:
+    """Which heap block `addr` points into, if any"""
+
+    if index is None or not isinstance(addr, str) or addr == "0x0":
+        return {}
+    with suppress(ValueError):
+        if found := index.find(addr):
+            block, offset = found
+            return {"block": block.addr, "offset": offset}
+    return {}
+
+
+def _record(
+    addresses: dict[tuple[str, str], Obj],
+    structs: dict[str, list[tuple[str, str]]],
+    type: str,
+    value: str | dict,
+    addr: str,
+    childs: list[tuple[str, str]],
+) -> bool:
+    """Add a traced object, unless it was already traced"""
+
+    if (addr, type) in addresses:
+        return False
+    addresses[addr, type] = Obj(type, value, addr)
+    if childs and not type.endswith("*") and not type.endswith("[]"):
+        try:
+            structs[type] = childs
+            addresses[addr, type] = Obj(
+                type,
+                {name: Obj(type, value[name], None) for name, type in childs},
+                addr,
+            )  # legacy
+        except Exception:
+            assert False, ([(name, type) for name, type in childs], value)
+    return True
+
+
+def _numbers(numbers: list[int]) -> str:
+    """
+    >>> _numbers([3, 4])
+    '3 4'
+    """
+
+    return " ".join(map(str, numbers))
+
+
+def _exited(stop: dict) -> bool:
+    """
+    >>> _exited({"reason": "exited-normally"})
+    True
+    """
+
+    return stop.get("reason", "").startswith("exited")
+
+
+def _first_error(results: list) -> ValueError | None:
+    for res in results:
+        if isinstance(res, ValueError):
+            return res
+        if isinstance(res, BaseException):
+            raise res
+    return None
+
+
+def _bounded(layout: Layout) -> Layout:
+    """`layout`, or the first `MAX_ELEMENTS` elements of it for an array"""
+
+    if layout.kind != ARRAY or layout.length <= MAX_ELEMENTS:
+        return layout
+    return Layout(
+        layout.type,
+        ARRAY,
+        layout.element.size * MAX_ELEMENTS,
+        (),
+        layout.element,
+        MAX_ELEMENTS,
+    )
+
+
+def _children(res: dict) -> list[tuple[str, str]]:
+    if res.get("numchild", "0") == "0":
+        return []
+    return [(c["exp"], c["type"]) for c in res["children"]]
+
+
+def _value(text: str) -> any:
+    with suppress(ValueError):
+        # Runs are as bounded as the elements GDB prints
+        return mion.expand(mion.valueloads(text), MAX_ELEMENTS)
+    return text
+
+
+def _address(res: dict) -> str:
+    return res["value"].split(" ", 1)[0]
@@ -0,0 +1,92 @@
+from __future__ import annotations
+from bisect import bisect_right
+from bisect import insort
+from dataclasses import dataclass
+from dataclasses import field
+
+"""Live heap blocks sorted by address, to find the block behind a pointer"""
+
+
+@dataclass(slots=True, frozen=True)
+class Allocation:
+    """A live heap block"""
+
+    addr: str
+    size: int
+    line: int
+    """Line of the call that allocated it"""
+    step: int
+    """The `Debugger.step` it was allocated during"""
+
+
+@dataclass(slots=True)
+class HeapIndex:
+    """
+    >>> index = HeapIndex()
+    >>> index.sync({
+    ...     "0x100": Allocation("0x100", 16, 3, 1),
+    ...     "0x200": Allocation("0x200", 8, 4, 2),
+    ... })
+    >>> block, offset = index.find(0x10c)
+    >>> block.addr, offset
+    ('0x100', 12)
+    >>> index.find(0x110) is None
+    True
+    >>> index.sync({"0x200": Allocation("0x200", 8, 4, 2)})
+    >>> index.find(0x100) is None
+    True
+    """
+
+    starts: list[int] = field(default_factory=list)
+    blocks: dict[int, Allocation] = field(default_factory=dict)
+
+    def add(self, block: Allocation) -> None:
+        start = int(block.addr, 16)
+        if start not in self.blocks:
+            insort(self.starts, start)
+        self.blocks[start] = block
+
+    def remove(self, addr: str) -> None:
+        start = int(addr, 16)
+        if self.blocks.pop(start, None) is not None:
+            del self.starts[bisect_right(self.starts, start) - 1]
+
+    def sync(self, blocks: dict[str, Allocation]) -> None:
+        """
+        Add and remove whatever changed since the last sync. Comparing is
+        linear in the number of blocks, as `blocks` are all of them.
+        """
+
+        stale = [
+            block.addr
+            for block in self.blocks.values()
+            if blocks.get(block.addr) != block
+        ]
+        added = len(blocks) - len(self.blocks) + len(stale)
+        if len(stale) + added > len(blocks).bit_length():
+            # Sorting once beats that many insertions into the list
+            self.blocks = {
+                int(addr, 16): block for addr, block in blocks.items()
+            }
+            self.starts = sorted(self.blocks)
+            return
+        for addr in stale:
+            self.remove(addr)
+        for addr, block in blocks.items():
+            if int(addr, 16) not in self.blocks:
+                self.add(block)
+
+    def find(self, addr: int | str) -> tuple[Allocation, int] | None:
+        """The block containing `addr` and the offset of `addr` in it"""
+
+        if isinstance(addr, str):
+            addr = int(addr.split(" ", 1)[0], 16)
+        i = bisect_right(self.starts, addr) - 1
+        if i < 0:
+            return None
+        block = self.blocks[self.starts[i]]
+        offset = addr - self.starts[i]
+        # Zero sized blocks still own the address they start at
+        if offset >= max(block.size, 1):
+            return None
+        return block, offset
@@ -0,0 +1,202 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from re import fullmatch
+from sys import byteorder
+
+"""Memory layouts of C types, for decoding raw memory reads locally"""
+
+INT = "int"
+UINT = "uint"
+BOOL = "bool"
+FLOAT = "float"
+POINTER = "pointer"
+STRUCT = "struct"
+ARRAY = "array"
+
+_SIGNED = {
+    "char",
+    "signed char",
+    "short",
+    "short int",
+    "int",
+    "long",
+    "long int",
+    "long long",
+    "long long int",
+}
+_UNSIGNED = {
+    "unsigned char",
+    "unsigned short",
+    "unsigned short int",
+    "unsigned int",
+    "unsigned",
+    "unsigned long",
+    "unsigned long int",
+    "unsigned long long",
+    "unsigned long long int",
+}
+_BOOL = {"_Bool", "bool"}
+_FLOAT = {"float", "double"}
+
+# `memoryview.cast` formats, by kind and size
+_FORMATS = {
+    (INT, 1): "b",
+    (INT, 2): "h",
+    (INT, 4): "i",
+    (INT, 8): "q",
+    (UINT, 1): "B",
+    (UINT, 2): "H",
+    (UINT, 4): "I",
+    (UINT, 8): "Q",
+    (BOOL, 1): "?",
+    (FLOAT, 4): "f",
+    (FLOAT, 8): "d",
+}
+
+
+@dataclass(slots=True, frozen=True)
+class Field:
+    name: str
+    offset: int
+    layout: Layout
+
+
+@dataclass(slots=True, frozen=True)
+class Layout:
+    type: str
+    kind: str
+    size: int
+    fields: tuple[Field, ...] = ()
+    element: Layout | None = None
+    length: int = 0
+
+
+def scalar_kind(type: str) -> str | None:
+    """
+    >>> scalar_kind('unsigned int')
+    'uint'
+    >>> scalar_kind('struct node *')
+    'pointer'
+    >>> scalar_kind('struct node') is None
+    True
+    """
+
+    if type.endswith("*"):
+        return POINTER
+    if type in _SIGNED:
+        return INT
+    if type in _UNSIGNED:
+        return UINT
+    if type in _BOOL:
+        return BOOL
+    if type in _FLOAT:
+        return FLOAT
+    return None
+
+
+def textual(type: str) -> bool:
+    """
+    Whether GDB prints values of `type` as strings, which raw memory does
+    not hold (for pointers) or decodes differently (for arrays)
+
+    >>> textual('const char *'), textual('char [16]'), textual('char **')
+    (True, True, False)
+    """
+
+    return fullmatch(_TEXTUAL, type) is not None
+
+
+_TEXTUAL = r"(?:const )?(?:(?:un)?signed )?char(?: const)? ?(?:\*|\[\d+\])"
+
+
+def scalar(type: str, size: int) -> Layout | None:
+    """
+    >>> scalar('unsigned int', 4).kind
+    'uint'
+    >>> scalar('long double', 16) is None
+    True
+    """
+
+    kind = scalar_kind(type)
+    if kind == POINTER and size in (4, 8) or (kind, size) in _FORMATS:
+        return Layout(type, kind, size)
+    return None
+
+
+def split_array(type: str) -> tuple[str, int] | None:
+    """
+    (element type, length) of an array type
+
+    >>> split_array('int [5]')
+    ('int', 5)
+    >>> split_array('int [3][4]')
+    ('int [4]', 3)
+    >>> split_array('int *') is None
+    True
+    """
+
+    match = fullmatch(r"(.*?) ?\[(\d+)\](.*)", type)
+    if match is None:
+        return None
+    base, length, rest = match.groups()
+    return f"{base} {rest}" if rest else base, int(length)
+
+
+def decode(layout: Layout, data: bytes | memoryview, offset: int = 0) -> any:
+    """
+    Decode the object at `offset` in `data` the same way `mion.valueloads`
+    parses GDB's rendering of it, with runs expanded
+
+    >>> node = Layout("struct node", STRUCT, 16, (
+    ...     Field("data", 0, Layout("int", INT, 4)),
+    ...     Field("next", 8, Layout("struct node *", POINTER, 8)),
+    ... ))
+    >>> decode(node, (-2).to_bytes(4, byteorder, signed=True) + bytes(12))
+    {'data': -2, 'next': '0x0'}
+    >>> array = Layout("int [3]", ARRAY, 12, (), Layout("int", INT, 4), 3)
+    >>> decode(array, b"".join(i.to_bytes(4, byteorder) for i in range(3)))
+    [0, 1, 2]
+    """
+
+    data = memoryview(data)
+    end = offset + layout.size
+    if layout.kind == POINTER:
+        return hex(int.from_bytes(data[offset:end], byteorder))
+    if layout.kind == STRUCT:
+        return {
+            field.name: decode(field.layout, data, offset + field.offset)
+            for field in layout.fields
+        }
+    if layout.kind == ARRAY:
+        element = layout.element
+        if format := _FORMATS.get((element.kind, element.size)):
+            # Contiguous scalars are decoded in one go
+            return data[offset:end].cast(format).tolist()
+        return [
+            decode(element, data, offset + i * element.size)
+            for i in range(layout.length)
+        ]
+    return data[offset:end].cast(_FORMATS[layout.kind, layout.size])[0]
+
+
+def children(layout: Layout, addr: int) -> list[tuple[str, Layout, int]]:
+    """
+    (name, layout, address) of each field or element, as named by
+    `-var-list-children`
+
+    >>> array = Layout("int [2]", ARRAY, 8, (), Layout("int", INT, 4), 2)
+    >>> [(name, hex(addr)) for name, _, addr in children(array, 0x100)]
+    [('0', '0x100'), ('1', '0x104')]
+    """
+
+    if layout.kind == STRUCT:
+        return [
+            (field.name, field.layout, addr + field.offset)
+            for field in layout.fields
+        ]
+    if layout.kind == ARRAY:
+        return [
+            (str(i), layout.element, addr + i * layout.element.size)
+            for i in range(layout.length)
+        ]
+    return []
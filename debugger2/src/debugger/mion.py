@@ -1,7 +1,6 @@
-from re import sub
-from re import fullmatch
+from dataclasses import dataclass
+from re import compile
 from re import Match
-from itertools import pairwise
 import json
 
 """(GDB) MI object notation"""
@@ -30,7 +29,9 @@ OUTPUT = {RESULT} | OUT_OF_BAND
 
 def loads(result: str) -> any:
     """
-    Parse GDB MI "result" output into a Python object
+    Parse GDB MI "result" output into a Python object, in one pass. Tuples
+    become dicts, and lists become lists of their values, even when the
+    values are named.
 
     >>> loads('key="abc"')
     {'key': 'abc'}
@@ -38,93 +39,268 @@ def loads(result: str) -> any:
     {}
     >>> loads('"abcd"')
     'abcd'
+    >>> loads('stack=[frame={level="0",func="main"}],args=[]')
+    {'stack': [{'level': '0', 'func': 'main'}], 'args': []}
+    >>> loads('value="\\\\"a\\\\"\\\\t\\\\265"')
+    {'value': '"a"\\tµ'}
     """
 
-    result = _remove_octals(result)
-    result = _remove_array_keys(result)
-    result = sub(r"([a-zA-Z\-_]+)=", r'"\1":', result)  # replace kv pairs
-    try:
-        return json.loads(f"{{{result}}}")
-    except json.JSONDecodeError:
-        return json.loads(result)
+    if not result:
+        return {}
+    if result[0] in '"{[':
+        value, end = _value(result, 0)
+    else:
+        value, end = _results(result, 0)
+    if end != len(result):
+        raise ValueError(f"Unexpected {result[end:end + 16]!r} in MI output")
+    return value
+
+
+# A C string's body, and a result's name (e.g. "thread-id")
+_STRING = compile(r'"([^"\\]*(?:\\.[^"\\]*)*)"')
+_NAME = compile(r"([a-zA-Z0-9_\-]+)=")
+# Most results are strings, so they are matched with their names in one go
+_NAMED_STRING = compile(r'([a-zA-Z0-9_\-]+)="([^"\\]*(?:\\.[^"\\]*)*)"')
+_ESCAPE = compile(r"\\([0-7]{1,3}|.)")
+_ESCAPES = {
+    "n": "\n",
+    "t": "\t",
+    "r": "\r",
+    "a": "\a",
+    "b": "\b",
+    "f": "\f",
+    "v": "\v",
+    "e": "\x1b",
+}
+
+
+def _unescape(match: Match) -> str:
+    escape = match.group(1)
+    if escape[0] in "01234567":
+        # GDB escapes each byte it does not print, as octal
+        return chr(int(escape, 8))
+    return _ESCAPES.get(escape, escape)
+
+
+def _results(text: str, pos: int) -> tuple[dict, int]:
+    results = {}
+    while True:
+        if match := _NAMED_STRING.match(text, pos):
+            name, string = match.groups()
+            if "\\" in string:
+                string = _ESCAPE.sub(_unescape, string)
+            results[name] = string
+            pos = match.end()
+        elif match := _NAME.match(text, pos):
+            results[match.group(1)], pos = _value(text, match.end())
+        else:
+            raise ValueError(f"Expected a result at {pos} in MI output")
+        if text[pos : pos + 1] != ",":
+            return results, pos
+        pos += 1
+
+
+def _value(text: str, pos: int) -> tuple[any, int]:
+    char = text[pos : pos + 1]
+    if char == '"':
+        match = _STRING.match(text, pos)
+        if match is None:
+            raise ValueError(f"Unterminated string at {pos} in MI output")
+        string = match.group(1)
+        if "\\" in string:
+            string = _ESCAPE.sub(_unescape, string)
+        return string, match.end()
+    if char == "{":
+        if text[pos + 1 : pos + 2] == "}":
+            return {}, pos + 2
+        value, pos = _results(text, pos + 1)
+        close = "}"
+    elif char == "[":
+        if text[pos + 1 : pos + 2] == "]":
+            return [], pos + 2
+        value = []
+        pos += 1
+        while True:
+            if text[pos : pos + 1] not in ('"', "{", "["):
+                # Named values, e.g. [frame={...},frame={...}]
+                match = _NAME.match(text, pos)
+                if match is None:
+                    break
+                pos = match.end()
+            item, pos = _value(text, pos)
+            value.append(item)
+            if text[pos : pos + 1] != ",":
+                break
+            pos += 1
+        close = "]"
+    else:
+        raise ValueError(f"Expected a value at {pos} in MI output")
+    if text[pos : pos + 1] != close:
+        raise ValueError(f"Expected {close!r} at {pos} in MI output")
+    return value, pos + 1
+
+
+@dataclass(slots=True, frozen=True)
+class Repeat:
+    """`count` copies of `value`, as GDB abbreviates runs in arrays"""
+
+    value: any
+    count: int
 
 
 def valueloads(result: str) -> any:
     """
+    Parse GDB's rendering of a C value. Structs become dicts, arrays lists
+    (with runs kept as `Repeat`s), pointers their address (and string) and
+    chars their code, and anything else GDB prints in angle brackets stays
+    as it is. Strings GDB splits around runs are joined again.
+
     >>> valueloads('{v = 0x0, data = 2}')
     {'v': '0x0', 'data': 2}
+    >>> valueloads("{65 'A', 0 '\\\\000' <repeats 15 times>}")
+    [65, Repeat(value=0, count=15)]
+    >>> valueloads('{f = 0x1139 <main>, s = 0x2004 "hi", x = <optimized out>}')
+    {'f': '0x1139', 's': '0x2004 "hi"', 'x': '<optimized out>'}
+    >>> valueloads("\\"ab\\", 'x' <repeats 4 times>, \\"cd\\"")
+    'abxxxxcd'
     """
 
-    result = _remove_octals(result)
-    result = _remove_array_keys(result)
-    result = _remove_hexnums(result)
-    result = sub(r"= (\d+) '[^']+'", r"= \1", result)  # remove char aliases
-    result = sub(
-        r"= (\"0x[0-9a-zA-Z]+\") <[^>]+>", r"= \1", result
-    )  # remove function aliases
-    result = sub(r"([a-zA-Z\-_]+) =", r'"\1":', result)  # replace kv pairs
-    return json.loads(result)
+    elements, pos = _elements(result, 0, "")
+    if pos != len(result):
+        raise ValueError(f"Unexpected {result[pos:pos + 16]!r} in value")
+    if len(elements) == 1 and not isinstance(elements[0], Repeat):
+        return elements[0]
+    return elements
 
 
-def _remove_array_keys(text: str) -> str:
-    """
-    >>> input = 'aaa=[bbb={ccc="0"},bbb={ccc="1"}]'
-    >>> _remove_array_keys(input)
-    'aaa=[{ccc="0"},{ccc="1"}]'
+def expand(value: any, limit: int | None = None) -> any:
     """
+    Expand the `Repeat`s in a parsed value, at any depth, keeping at most
+    `limit` elements of each array if given
 
-    chars = list[str]()
-    brace_stack = ["{"]
-    if text:
-        chars.append(text[0])
-
-    for prev, char in pairwise(text):
-        if prev != "\\" and brace_stack[-1] == '"':
-            if char == '"':
-                brace_stack.pop()
-        elif prev != "\\":
-            match char:
-                case '"':
-                    brace_stack.append('"')
-                case "{":
-                    brace_stack.append("{")
-                case "}":
-                    assert brace_stack[-1] == "{"
-                    brace_stack.pop()
-                case "[":
-                    brace_stack.append("[")
-                case "]":
-                    assert brace_stack[-1] == "["
-                    brace_stack.pop()
-
-        if char != "=" or brace_stack[-1] != "[":
-            chars.append(char)
-            continue
-        while fullmatch(r"[a-zA-Z\-_]", chars[-1]):
-            chars.pop()
-    return "".join(chars)
-
-
-def _remove_octals(text: str) -> str:
-    """
-    >>> input = '\\\\000\\\\265zv'
-    >>> _remove_octals(input)
-    '\\\\u0000\\\\u00b5zv'
+    >>> expand([1, Repeat(0, 3), {'a': [Repeat(2, 2)]}])
+    [1, 0, 0, 0, {'a': [2, 2]}]
+    >>> expand([Repeat(7, 10**9), 8], limit=3)
+    [7, 7, 7]
     """
 
-    def octal_to_unicode(match: Match):
-        octal = int(match.group(1), 8)
-        return f"\\u{octal:04x}"
+    if isinstance(value, dict):
+        return {k: expand(v, limit) for k, v in value.items()}
+    if not isinstance(value, list):
+        return value
+    expanded = []
+    for element in value:
+        if limit is not None and len(expanded) >= limit:
+            break
+        if isinstance(element, Repeat):
+            count = element.count
+            if limit is not None:
+                count = min(count, limit - len(expanded))
+            expanded += [expand(element.value, limit)] * count
+        elif isinstance(element, (list, dict)):
+            expanded.append(expand(element, limit))
+        else:
+            expanded.append(element)
+    return expanded
 
-    return sub(r"\\([0-7]{1,3})", octal_to_unicode, text)
 
+_C_NUMBER = r"-?\d+(?:\.\d+)?(?:e[+-]?\d+)?"
+# Arrays of plain numbers, which are parsed all at once
+_C_NUMBERS = compile(rf"\{{({_C_NUMBER}(?:, {_C_NUMBER})*)\}}")
+_C_FIELD = compile(r"([a-zA-Z_]\w*) = ")
+_C_REPEATS = compile(r" <repeats (\d+) times>")
+_C_STRING = r'"[^"\\]*(?:\\.[^"\\]*)*"(?:\.\.\.)?'
+_C_CHAR = r"'(?:[^'\\]|\\[0-7]{1,3}|\\.)+'"
+_C_SCALAR = compile(
+    rf"(0x[0-9a-fA-F]+)(?: <[^>]*>)?( {_C_STRING})?"
+    rf"|({_C_NUMBER})(?: {_C_CHAR})?"
+    rf"|({_C_STRING})"
+    rf"|({_C_CHAR})"
+    r"|(true|false)"
+    r"|(-?nan\(0x[0-9a-f]+\)|-?inf|[a-zA-Z_]\w*|<[^>]*>)"
+)
+
+
+def _elements(text: str, pos: int, close: str) -> tuple[list | dict, int]:
+    """Comma separated (named) values, up to `close`"""
+
+    elements = []
+    fields = {}
+    # Whether the last value was (part of) a string, and had a run in it
+    string = run = False
+    while True:
+        if field := _C_FIELD.match(text, pos):
+            pos = field.end()
+        quote = text[pos : pos + 1]
+        value, pos = _c_value(text, pos)
+        repeats = _C_REPEATS.match(text, pos)
+        if repeats:
+            pos = repeats.end()
+        # A run of chars is part of a string, but a repeated string is a
+        # run of elements, e.g. of a char [12][3]
+        char_run = quote == "'" and repeats is not None
+        segment = quote == "'" or quote == '"' and repeats is None
+        if char_run:
+            value *= int(repeats.group(1))
+        elif repeats:
+            value = Repeat(value, int(repeats.group(1)))
+
+        if segment and string and not field and (run or char_run):
+            # GDB splits strings around runs, e.g. "ab", '\\000' <repeats 14
+            # times>, but never puts two strings of an array side by side
+            if fields:
+                fields[last] += value
+            else:
+                elements[-1] += value
+            run = True
+        else:
+            if field:
+                last = field.group(1)
+                fields[last] = value
+            else:
+                elements.append(value)
+            string, run = segment, char_run
+        if text.startswith("...", pos):
+            # Past GDB's `print elements` limit
+            pos += 3
+        if not text.startswith(", ", pos):
+            break
+        pos += 2
+    if close and text[pos : pos + 1] != close:
+        raise ValueError(f"Expected {close!r} at {pos} in value")
+    if fields and elements:
+        raise ValueError(f"Unnamed value among fields at {pos} in value")
+    return fields or elements, pos + len(close)
+
+
+def _c_value(text: str, pos: int) -> tuple[any, int]:
+    if text[pos : pos + 1] == "{":
+        if numbers := _C_NUMBERS.match(text, pos):
+            return json.loads(f"[{numbers.group(1)}]"), numbers.end()
+        if text[pos + 1 : pos + 2] == "}":
+            return [], pos + 2
+        return _elements(text, pos + 1, "}")
+    match = _C_SCALAR.match(text, pos)
+    if match is None:
+        raise ValueError(f"Expected a value at {pos} in value")
+    pointer, pointee, number, string, char, boolean, word = match.groups()
+    if number is not None:
+        value = json.loads(number)
+    elif pointer is not None:
+        # A `char *` keeps the string it points to, as GDB printed it
+        value = pointer + (pointee or "")
+    elif string is not None:
+        value = _c_unescape(string.removesuffix("...")[1:-1])
+    elif char is not None:
+        value = _c_unescape(char[1:-1])
+    elif boolean is not None:
+        value = boolean == "true"
+    else:
+        value = word
+    return value, match.end()
 
-def _remove_hexnums(text: str) -> str:
-    """
-    >>> _remove_hexnums('0x0')
-    '"0x0"'
-    >>> _remove_hexnums('0xdeadbeef')
-    '"0xdeadbeef"'
-    """
 
-    return sub(r"(0x[0-9a-fA-F]{1,16})", r'"\1"', text)
+def _c_unescape(text: str) -> str:
+    if "\\" in text:
+        return _ESCAPE.sub(_unescape, text)
+    return text
@@ -0,0 +1,49 @@
+from pathlib import Path
+
+from debugger import Debugger, TracePolicy, compile
+
+here = Path(__file__).parent
+
+
+async def test_agent():
+    source = here / "test_budget.c"
+    exe = here / "test_agent"
+    await compile(source, exe)
+
+    debug = Debugger()
+    try:
+        await debug.init(exe)
+        assert debug.agent
+        await debug.breakpoint(f"{source}:16")
+        await debug.run()
+
+        # Called directly, so that a broken agent cannot hide behind the
+        # fallback to `mi_trace`
+        frames, memory, _ = await debug.agent_trace(TracePolicy())
+        assert frames[0].frame.func == "main"
+        assert frames[0].vars.keys() == {"list"}
+        nodes = [
+            obj for (_, type), obj in memory.items() if type == "struct node"
+        ]
+        assert len(nodes) == 6
+
+        _, memory, _ = await debug.agent_trace(TracePolicy(max_depth=2))
+        nodes = [
+            obj for (_, type), obj in memory.items() if type == "struct node"
+        ]
+        assert sum(obj.expanded for obj in nodes) == 2
+
+        # One command to the agent reads the same as five per expression
+        exprs = ["list", "*list", "list->data", "no_such_variable"]
+        described = await debug._agent_vars_details(exprs, 0)
+        debug.agent = False
+        read = await debug._vars_details(exprs, 0)
+        debug.agent = True
+        assert described[:3] == read[:3]
+        assert described[0][3] == [("data", "int"), ("next", "struct node *")]
+        assert isinstance(described[3], ValueError)
+        assert isinstance(read[3], ValueError)
+
+    finally:
+        await debug.deinit()
+        exe.unlink()
@@ -0,0 +1,9 @@
+#include <stdlib.h>
+
+int main(void) {
+    int *numbers = malloc(4 * sizeof(int));
+    char *name = calloc(8, 1);
+    numbers = realloc(numbers, 16 * sizeof(int));
+    free(name);
+    return 0;
+}
@@ -0,0 +1,40 @@
+from pathlib import Path
+
+from debugger import Debugger, compile
+
+here = Path(__file__).parent
+
+
+async def test_allocations():
+    source = here / "test_allocations.c"
+    exe = here / "test_allocations"
+    await compile(source, exe)
+
+    debug = Debugger()
+    try:
+        await debug.init(exe)
+        assert await debug.track_allocations()
+        await debug.breakpoint("main")
+        await debug.run()
+
+        await debug.next()
+        await debug.next()
+        allocations = await debug.allocations()
+        numbers = (await debug.variables())["numbers"]
+        assert allocations[numbers].size == 16
+        assert allocations[numbers].line == 4
+        assert allocations[numbers].step == 1
+        assert len(allocations) == 2
+
+        await debug.next()
+        await debug.next()
+        allocations = await debug.allocations()
+        (block,) = allocations.values()
+        assert block.addr == (await debug.variables())["numbers"]
+        assert (block.size, block.line, block.step) == (64, 6, 3)
+        assert await debug.resolve(int(block.addr, 16) + 60) == (block, 60)
+        assert await debug.resolve(int(block.addr, 16) + 64) is None
+
+    finally:
+        await debug.deinit()
+        exe.unlink()
@@ -0,0 +1,17 @@
+#include <stdlib.h>
+
+struct point {
+    int x;
+    int y;
+};
+
+int main() {
+    int stack[4] = {1, 2, 3, 4};
+    struct point origin = {-1, 7};
+    int *heap = malloc(5 * sizeof(int));
+    for (int i = 0; i < 5; i++) {
+        heap[i] = i * i;
+    }
+    free(heap);
+    return 0;
+}
@@ -0,0 +1,38 @@
+from pathlib import Path
+
+from debugger import Debugger, compile
+
+here = Path(__file__).parent
+
+
+async def test_arrays():
+    source = here / "test_arrays.c"
+    exe = here / "test_arrays"
+    await compile(source, exe)
+
+    debug = Debugger(use_agent=False)
+    try:
+        await debug.init(exe)
+        await debug.breakpoint(f"{source}:15")
+        await debug.run()
+        assert (await debug.frames())[0].line == 15
+
+        addr = (await debug.variables())["heap"]
+        assert await debug.read_array(addr, "int", 5) == [0, 1, 4, 9, 16]
+
+        frames, memory, _ = await debug.trace()
+        stack = frames[0].vars["stack"]
+        assert memory[stack.addr, "int"].value == 1
+        assert memory[hex(int(stack.addr, 16) + 12), "int"].value == 4
+
+        origin = frames[0].vars["origin"]
+        assert origin.value == {"x": -1, "y": 7}
+        assert memory[hex(int(origin.addr, 16) + 4), "int"].value == 7
+
+        layout = await debug.type_layout("struct point")
+        assert layout.size == 8
+        assert [field.offset for field in layout.fields] == [0, 4]
+
+    finally:
+        await debug.deinit()
+        exe.unlink()
@@ -0,0 +1,17 @@
+#include <stdlib.h>
+
+struct node {
+    int data;
+    struct node *next;
+};
+
+int main(void) {
+    struct node *list = NULL;
+    for (int i = 0; i < 6; i++) {
+        struct node *head = malloc(sizeof(struct node));
+        head->data = i;
+        head->next = list;
+        list = head;
+    }
+    return 0;
+}
@@ -0,0 +1,45 @@
+from pathlib import Path
+
+from debugger import Debugger, TracePolicy, compile
+
+here = Path(__file__).parent
+
+
+async def test_budget():
+    source = here / "test_budget.c"
+    exe = here / "test_budget"
+    await compile(source, exe)
+
+    debug = Debugger(use_agent=False)
+    try:
+        await debug.init(exe)
+        await debug.breakpoint(f"{source}:16")
+        await debug.run()
+
+        def nodes(memory):
+            return {
+                addr: obj
+                for (addr, type), obj in memory.items()
+                if type == "struct node"
+            }
+
+        _, memory, _ = await debug.trace()
+        assert len(nodes(memory)) == 6
+        assert all(obj.expanded for obj in memory.values())
+
+        _, memory, _ = await debug.trace(TracePolicy(max_depth=2))
+        traced = nodes(memory)
+        assert len(traced) == 3
+        (stub,) = [obj for obj in traced.values() if not obj.expanded]
+        assert stub.value is None
+
+        memory, _ = await debug.expand(stub.addr, stub.type)
+        assert len(nodes(memory)) == 4
+        assert all(obj.expanded for obj in memory.values())
+
+        _, memory, _ = await debug.trace(TracePolicy(max_nodes=1))
+        assert sum(obj.expanded for obj in nodes(memory).values()) == 1
+
+    finally:
+        await debug.deinit()
+        exe.unlink()
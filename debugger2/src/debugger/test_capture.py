@@ -0,0 +1,55 @@
+from contextlib import aclosing
+from pathlib import Path
+
+from debugger import Debugger, compile
+
+here = Path(__file__).parent
+
+
+async def test_capture():
+    source = here / "test_fibonacci.c"
+    exe = here / "exe_capture"
+    await compile(source, exe)
+
+    debug = Debugger(use_agent=False)
+    try:
+        await debug.init(exe)
+        await debug.breakpoint("main")
+        await debug.run()
+
+        values = list[int]()
+        async for stop, (frames, _, _) in debug.capture([f"{source}:10"]):
+            assert stop["frame"]["line"] == "10"
+            values.append(frames[0].vars["next"].value)
+        assert values == [1, 2, 3, 5, 8, 13, 21, 34, 55, 89]
+        assert debug.step == 11
+
+    finally:
+        await debug.deinit()
+        exe.unlink()
+
+
+async def test_steps():
+    source = here / "test_fibonacci.c"
+    exe = here / "exe_steps"
+    await compile(source, exe)
+
+    debug = Debugger(use_agent=False)
+    try:
+        await debug.init(exe)
+        await debug.breakpoint("main")
+        await debug.run()
+
+        lines = list[int]()
+        async with aclosing(debug.steps(queue_size=1)) as steps:
+            async for _, (frames, _, _) in steps:
+                lines.append(frames[0].frame.line)
+                if len(lines) == 2:
+                    break
+        assert lines == [17, 18]
+        # Stepping stopped at most a step past the last state consumed
+        assert debug.step in (2, 3)
+
+    finally:
+        await debug.deinit()
+        exe.unlink()
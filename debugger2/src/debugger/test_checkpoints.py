@@ -0,0 +1,34 @@
+from pathlib import Path
+
+from debugger import Debugger, compile
+
+here = Path(__file__).parent
+
+
+async def test_checkpoints():
+    source = here / "test_fibonacci.c"
+    exe = here / "exe_checkpoints"
+    await compile(source, exe)
+
+    debug = Debugger(use_agent=False, checkpoint_interval=4)
+    try:
+        await debug.init(exe)
+        await debug.breakpoint("fibonacci")
+        await debug.run()
+        for _ in range(12):
+            await debug.next()
+        assert debug.checkpoints.steps == [0, 4, 8, 12]
+        late = await debug.variables()
+
+        await debug.restart(6)
+        assert debug.step == 6
+        assert debug.checkpoints.steps == [0, 4]
+        assert (await debug.variables())["a"] != late["a"]
+
+        for _ in range(6):
+            await debug.next()
+        assert await debug.variables() == late
+
+    finally:
+        await debug.deinit()
+        exe.unlink()
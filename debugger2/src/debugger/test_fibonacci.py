@@ -34,6 +34,9 @@ async def test_fibonacci():
             "fibonacci",
             "main",
         ]
+        hits = debug.memo_stats.hits
+        assert len(await debug.frames()) == 2
+        assert debug.memo_stats.hits == hits + 1
         assert (await debug.variables()).keys() == {"n", "a", "b", "next"}
 
         await debug.next()
@@ -79,3 +82,38 @@ async def test_fibonacci():
         "".join(inferior_output)
         == "Fibonacci sequence up to 10 terms:\r\n0 1 1 2 3 5 8 13 21 34 \r\n"
     )
+
+
+async def test_fibonacci_incremental_trace():
+    source = here / "test_fibonacci.c"
+    exe = here / "exe_incremental"
+    await compile(source, exe)
+
+    debug = Debugger(use_agent=False)
+    try:
+        await debug.init(exe)
+        await debug.breakpoint("fibonacci")
+        await debug.run()
+        for _ in range(3):
+            await debug.next()
+
+        frames, _, _ = await debug.trace()
+        assert frames[0].vars["i"].value == 1
+        assert frames[0].vars["next"].value == 0xBEEF
+
+        # One loop iteration later, the same varobjs report the new values
+        for _ in range(5):
+            await debug.next()
+
+        frames, memory, _ = await debug.trace()
+        fibonacci = frames[0]
+        assert fibonacci.vars["i"].value == 2
+        assert fibonacci.vars["a"].value == 1
+        assert fibonacci.vars["b"].value == 1
+        assert fibonacci.vars["next"].value == 1
+        assert fibonacci.vars["n"].value == 10
+        assert memory[fibonacci.vars["next"].addr, "int"].value == 1
+
+    finally:
+        await debug.deinit()
+        exe.unlink()
@@ -0,0 +1,170 @@
+from itertools import pairwise
+from pathlib import Path
+from re import Match
+from re import fullmatch
+from re import sub
+import json
+
+from pytest import raises
+
+from debugger import mion
+
+here = Path(__file__).parent
+
+
+def reference_loads(result: str) -> any:
+    """The regex and JSON based parser `mion.loads` replaced"""
+
+    result = _remove_octals(result)
+    result = _remove_array_keys(result)
+    result = sub(r"([a-zA-Z\-_]+)=", r'"\1":', result)  # replace kv pairs
+    try:
+        return json.loads(f"{{{result}}}")
+    except json.JSONDecodeError:
+        return json.loads(result)
+
+
+def _remove_array_keys(text: str) -> str:
+    chars = list[str]()
+    brace_stack = ["{"]
+    if text:
+        chars.append(text[0])
+
+    for prev, char in pairwise(text):
+        if prev != "\\" and brace_stack[-1] == '"':
+            if char == '"':
+                brace_stack.pop()
+        elif prev != "\\":
+            match char:
+                case '"':
+                    brace_stack.append('"')
+                case "{":
+                    brace_stack.append("{")
+                case "}":
+                    assert brace_stack[-1] == "{"
+                    brace_stack.pop()
+                case "[":
+                    brace_stack.append("[")
+                case "]":
+                    assert brace_stack[-1] == "["
+                    brace_stack.pop()
+
+        if char != "=" or brace_stack[-1] != "[":
+            chars.append(char)
+            continue
+        while fullmatch(r"[a-zA-Z\-_]", chars[-1]):
+            chars.pop()
+    return "".join(chars)
+
+
+def _remove_octals(text: str) -> str:
+    def octal_to_unicode(match: Match):
+        octal = int(match.group(1), 8)
+        return f"\\u{octal:04x}"
+
+    return sub(r"\\([0-7]{1,3})", octal_to_unicode, text)
+
+
+def payloads() -> list[str]:
+    """What `loads` is given for each record in the corpus"""
+
+    messages = list[str]()
+    for line in (here / "test_mion.mi").read_text().splitlines():
+        kind, message = line[:1], line[1:]
+        if kind in mion.STREAM:
+            messages.append(message)
+        else:
+            messages.append(message.split(",", 1)[1] if "," in message else "")
+    return messages
+
+
+def as_reference(value: any) -> any:
+    """
+    The reference also rewrites octal escapes within C strings, which GDB
+    renders as e.g. "\\\\000" in values, to "\\\\u0000"; `valueloads`
+    reads both the same
+    """
+
+    if isinstance(value, str):
+        return _remove_octals(value)
+    if isinstance(value, dict):
+        return {key: as_reference(item) for key, item in value.items()}
+    return [as_reference(item) for item in value]
+
+
+def test_mion_matches_reference():
+    messages = payloads()
+    assert len(messages) > 40
+    for message in messages:
+        assert as_reference(mion.loads(message)) == reference_loads(
+            message
+        ), message
+
+
+def test_mion_large_reply():
+    variables = ",".join(
+        f'{{name="v{i}",type="char [4]",value="\\"a\\\\00{i % 8}b\\""}}'
+        for i in range(1000)
+    )
+    message = f"variables=[{variables}]"
+    assert as_reference(mion.loads(message)) == reference_loads(message)
+    assert mion.loads(message)["variables"][3]["value"] == '"a\\003b"'
+
+
+def test_valueloads():
+    assert mion.valueloads("{{x = 1, y = 2}, {x = 3, y = 4}}") == [
+        {"x": 1, "y": 2},
+        {"x": 3, "y": 4},
+    ]
+    assert mion.valueloads(
+        '{name = "a, b = {c}", grid = {{1, 2}, {3, 4}}, next = 0x0}'
+    ) == {"name": "a, b = {c}", "grid": [[1, 2], [3, 4]], "next": "0x0"}
+    assert mion.valueloads(
+        "{{x = 0, y = 0} <repeats 99 times>, {x = 1, y = -1}}"
+    ) == [mion.Repeat({"x": 0, "y": 0}, 99), {"x": 1, "y": -1}]
+    assert mion.valueloads("{1.5, -2, 3.0000000000000001e-05}") == [
+        1.5,
+        -2,
+        3.0000000000000001e-05,
+    ]
+    assert mion.valueloads("{1, 2, 3...}") == [1, 2, 3]
+    # Strings are split around runs, in fields too
+    assert mion.valueloads(
+        "{name = \"abc\", '\\000' <repeats 16 times>, x = 5}"
+    ) == {"name": "abc" + "\0" * 16, "x": 5}
+    assert mion.valueloads(
+        '{"ab", "cd", \'\\000\' <repeats 6 times>, "ef"}'
+    ) == ["ab", "cd" + "\0" * 6 + "ef"]
+    # A repeated string is a run of elements, of a char [12][3] here
+    assert mion.valueloads('{"ab" <repeats 12 times>}') == [
+        mion.Repeat("ab", 12)
+    ]
+    assert mion.valueloads('{"ab" <repeats 11 times>, "cd"}') == [
+        mion.Repeat("ab", 11),
+        "cd",
+    ]
+    assert mion.valueloads('{s = 0x4006 "hi", t = 0x0}') == {
+        "s": '0x4006 "hi"',
+        "t": "0x0",
+    }
+    assert mion.expand(
+        mion.valueloads("{{1 <repeats 3 times>}, {x = {2 <repeats 2 times>}}}")
+    ) == [[1, 1, 1], {"x": [2, 2]}]
+    # What -var-evaluate-expression shows for a struct
+    with raises(ValueError):
+        mion.valueloads("{...}")
+
+
+def test_valueloads_large_array():
+    values = list(range(-50000, 50000))
+    text = "{" + ", ".join(map(str, values)) + "}"
+    assert mion.valueloads(text) == values
+    assert (
+        mion.expand(mion.valueloads("{7 <repeats 100000 times>}"))
+        == [7] * 100000
+    )
+    # What the Debugger keeps of it
+    assert (
+        mion.expand(mion.valueloads("{7 <repeats 100000 times>}"), 200)
+        == [7] * 200
+    )
@@ -0,0 +1,65 @@
+from pathlib import Path
+
+from pytest import raises
+
+from debugger import Debugger, compile
+
+here = Path(__file__).parent
+
+
+async def test_paging():
+    source = here / "test_arrays.c"
+    exe = here / "test_paging"
+    await compile(source, exe)
+
+    debug = Debugger(use_agent=False)
+    try:
+        await debug.init(exe)
+        await debug.breakpoint(f"{source}:15")
+        await debug.run()
+
+        frames, _, _ = await debug.trace()
+        stack = frames[0].vars["stack"]
+        page = await debug.page(stack.addr, stack.type, 1, 2)
+        assert [item.value for item in page.items] == [2, 3]
+        assert page.items[0].addr == hex(int(stack.addr, 16) + 4)
+        assert page.total == 4
+
+        page = await debug.page(stack.addr, stack.type, 3, 10)
+        assert [item.value for item in page.items] == [4]
+
+        heap = frames[0].vars["heap"]
+        page = await debug.page(heap.value, heap.type, 2, 3)
+        assert [item.value for item in page.items] == [4, 9, 16]
+
+    finally:
+        await debug.deinit()
+        exe.unlink()
+
+
+async def test_paging_chain():
+    source = here / "test_budget.c"
+    exe = here / "test_paging_chain"
+    await compile(source, exe)
+
+    debug = Debugger(use_agent=False)
+    try:
+        await debug.init(exe)
+        await debug.breakpoint(f"{source}:16")
+        await debug.run()
+
+        head = await debug.evaluate("list")
+        page = await debug.page(head, "struct node", 2, 3)
+        assert [item.value["data"] for item in page.items] == [3, 2, 1]
+        assert page.total is None
+
+        page = await debug.page(head, "struct node", 4, 10)
+        assert [item.value["data"] for item in page.items] == [1, 0]
+        assert page.total == 6
+
+        with raises(ValueError):
+            await debug.page(head, "struct node", 0, 1, link="prev")
+
+    finally:
+        await debug.deinit()
+        exe.unlink()
@@ -0,0 +1,39 @@
+from pathlib import Path
+
+from debugger import Debugger, compile
+
+here = Path(__file__).parent
+
+
+async def test_run_until():
+    source = here / "test_fibonacci.c"
+    exe = here / "exe_run_until"
+    await compile(source, exe)
+
+    debug = Debugger(use_agent=False)
+    try:
+        await debug.init(exe)
+        await debug.breakpoint("main")
+        await debug.breakpoint("fibonacci")
+        stop = await debug.run()
+        assert stop["reason"] == "breakpoint-hit"
+
+        # Goes past the breakpoint on fibonacci
+        await debug.until(f"{source}:10")
+        assert (await debug.frames())[0].line == 10
+        assert (await debug.variables())["i"] == "1"
+
+        await debug.next_n(5)
+        assert (await debug.frames())[0].line == 10
+        assert (await debug.variables())["i"] == "2"
+        assert debug.step == 2
+
+        await debug.step_out()
+        assert [frame.func for frame in await debug.frames()] == ["main"]
+
+        stop = await debug.cont()
+        assert stop["reason"] == "exited-normally"
+
+    finally:
+        await debug.deinit()
+        exe.unlink()
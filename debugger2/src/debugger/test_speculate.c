@@ -0,0 +1,11 @@
+#include <stdio.h>
+#include <unistd.h>
+
+int main(void) {
+    int a = 1;
+    printf("start\n");
+    a = 2;
+    sleep(5);
+    a = 3;
+    return 0;
+}
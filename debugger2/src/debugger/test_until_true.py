@@ -0,0 +1,43 @@
+from pathlib import Path
+
+from pytest import raises
+
+from debugger import Debugger, compile
+
+here = Path(__file__).parent
+
+
+async def test_until_true():
+    source = here / "test_fibonacci.c"
+    exe = here / "exe_until_true"
+    await compile(source, exe)
+
+    debug = Debugger(use_agent=False)
+    try:
+        await debug.init(exe)
+        await debug.breakpoint("fibonacci")
+        await debug.run()
+
+        await debug.until_true("a > 10")
+        assert (await debug.variables())["a"] == "13"
+        line = (await debug.frames())[0].line
+
+        # The same breakpoints are enabled again rather than re-inserted
+        breakpoints = len(debug.conditions)
+        await debug.until_true("a > 10")
+        assert (await debug.frames())[0].line != line
+        assert len(debug.conditions) == breakpoints
+
+        await debug.until_true("a > 20")
+        assert (await debug.variables())["a"] == "21"
+
+        # A condition GDB rejects fails without running the program
+        with raises(ValueError):
+            await debug.until_true("no_such_variable > 0")
+        assert len(debug.conditions) == breakpoints * 2
+        await debug.until_true("a > 30")
+        assert (await debug.variables())["a"] == "34"
+
+    finally:
+        await debug.deinit()
+        exe.unlink()
@@ -0,0 +1,42 @@
+from pathlib import Path
+
+from debugger import Debugger, compile
+
+here = Path(__file__).parent
+
+
+async def test_watch():
+    source = here / "test_fibonacci.c"
+    exe = here / "exe_watch"
+    await compile(source, exe)
+
+    debug = Debugger(use_agent=False)
+    try:
+        await debug.init(exe)
+        await debug.breakpoint("fibonacci")
+        await debug.run()
+        await debug.next()
+
+        frames, _, _ = await debug.trace()
+        vars = frames[0].vars
+        watched = [(vars[var].addr, vars[var].type) for var in ("a", "b")]
+
+        # One hardware watchpoint, one software
+        debug.max_hw_watchpoints = 1
+        stop = await debug.watch_until(watched)
+        assert stop["reason"] == "watchpoint-trigger"
+        assert await debug.variables() | {"i": None} == {
+            "n": "10",
+            "a": "1",
+            "b": "1",
+            "next": "1",
+            "i": None,
+        }
+
+        # The watchpoints are gone
+        stop = await debug.cont()
+        assert stop["reason"] == "exited-normally"
+
+    finally:
+        await debug.deinit()
+        exe.unlink()
@@ -0,0 +1,91 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from dataclasses import field
+
+"""Session-lived GDB variable objects, reused from one step to the next"""
+
+type FrameKey = tuple[int, str]
+"""(depth counted from the outermost frame, function name)"""
+
+type Key = tuple[FrameKey, str]
+"""(frame, expression)"""
+
+
+@dataclass(slots=True)
+class Varobj:
+    name: str
+    type: str
+    children: list[tuple[str, str]]
+    value: str | dict | None = None
+    addr: str | None = None
+    fresh: bool = False
+
+
+@dataclass(slots=True)
+class VarobjCache:
+    """
+    Varobjs keyed by frame and expression, plus which traced expression was
+    reached through which, so that a change reported by `-var-update` only
+    invalidates the affected subtrees.
+
+    >>> cache = VarobjCache()
+    >>> main = (0, "main")
+    >>> cache.add((main, "list"), Varobj("var1", "struct node *", []))
+    >>> cache.add((main, "(*list)"), Varobj("var2", "struct node", []))
+    >>> cache.link((main, "list"), (main, "(*list)"))
+    >>> for varobj in cache.varobjs.values():
+    ...     varobj.fresh = True
+    >>> cache.invalidate(cache.key("var2.data"))
+    >>> [varobj.fresh for varobj in cache.varobjs.values()]
+    [False, False]
+    """
+
+    varobjs: dict[Key, Varobj] = field(default_factory=dict)
+    names: dict[str, Key] = field(default_factory=dict)
+    children: dict[Key, set[Key]] = field(default_factory=dict)
+    parents: dict[Key, set[Key]] = field(default_factory=dict)
+
+    def add(self, key: Key, varobj: Varobj) -> None:
+        self.varobjs[key] = varobj
+        self.names[varobj.name] = key
+
+    def get(self, key: Key) -> Varobj | None:
+        return self.varobjs.get(key)
+
+    def remove(self, key: Key) -> Varobj | None:
+        varobj = self.varobjs.pop(key, None)
+        if varobj is not None:
+            del self.names[varobj.name]
+        for child in self.children.pop(key, ()):
+            self.parents.get(child, set()).discard(key)
+        for parent in self.parents.pop(key, ()):
+            self.children.get(parent, set()).discard(key)
+        return varobj
+
+    def key(self, name: str) -> Key | None:
+        """Key of the root varobj owning `name` (which may be a child)"""
+
+        return self.names.get(name.split(".", 1)[0])
+
+    def link(self, parent: Key, child: Key) -> None:
+        self.children.setdefault(parent, set()).add(child)
+        self.parents.setdefault(child, set()).add(parent)
+
+    def invalidate(self, key: Key | None) -> None:
+        """
+        Mark `key` stale, along with everything it was reached through
+        (their values embed it) and everything reached through it (their
+        addresses and values depend on it).
+        """
+
+        for edges in (self.parents, self.children):
+            pending = [key]
+            seen = set[Key]()
+            while pending:
+                current = pending.pop()
+                if current in seen:
+                    continue
+                seen.add(current)
+                if current in self.varobjs:
+                    self.varobjs[current].fresh = False
+                pending.extend(edges.get(current, ()))
@@ -0,0 +1,195 @@
+from dataclasses import dataclass
+from dataclasses import field
+
+"""Delta encoding of the (legacy) backend state sent to the client"""
+
+FRAME = "frame"
+STACK = "stack/"
+HEAP = "heap/"
+
+
+def flatten(mem: dict) -> dict[str, any]:
+    """
+    Entries of a legacy backend state, keyed by IDs that stay the same for
+    as long as the thing they name exists
+
+    >>> list(flatten({
+    ...     "frame_info": {"line_num": 3},
+    ...     "stack_data": {"n": {"value": 1}},
+    ...     "heap_data": {"0x10": {"value": 2}},
+    ... }))
+    ['frame', 'stack/n', 'heap/0x10']
+    """
+
+    return {
+        FRAME: mem["frame_info"],
+        **{STACK + name: var for name, var in mem["stack_data"].items()},
+        **{HEAP + addr: obj for addr, obj in mem["heap_data"].items()},
+    }
+
+
+def unflatten(entries: dict[str, any]) -> dict:
+    """
+    >>> mem = {
+    ...     "frame_info": {"line_num": 3},
+    ...     "stack_data": {"n": {"value": 1}},
+    ...     "heap_data": {"0x10": {"value": 2}},
+    ... }
+    >>> unflatten(flatten(mem)) == mem
+    True
+    """
+
+    return {
+        "frame_info": entries.get(FRAME, {}),
+        "stack_data": {
+            id.removeprefix(STACK): entry
+            for id, entry in entries.items()
+            if id.startswith(STACK)
+        },
+        "heap_data": {
+            id.removeprefix(HEAP): entry
+            for id, entry in entries.items()
+            if id.startswith(HEAP)
+        },
+    }
+
+
+def diff(old: dict[str, any], new: dict[str, any]) -> dict:
+    """
+    >>> diff({"a": 1, "b": 2}, {"b": 3, "c": 4})
+    {'added': {'c': 4}, 'changed': {'b': 3}, 'removed': ['a']}
+    """
+
+    return {
+        "added": {id: new[id] for id in new.keys() - old.keys()},
+        "changed": {
+            id: new[id] for id in new.keys() & old.keys() if new[id] != old[id]
+        },
+        "removed": sorted(old.keys() - new.keys()),
+    }
+
+
+def patch(old: dict[str, any], delta: dict) -> dict[str, any]:
+    """
+    >>> old, new = {"a": 1, "b": 2}, {"b": 3, "c": 4}
+    >>> patch(old, diff(old, new)) == new
+    True
+    """
+
+    entries = {
+        id: entry for id, entry in old.items() if id not in delta["removed"]
+    }
+    entries.update(delta["added"])
+    entries.update(delta["changed"])
+    return entries
+
+
+@dataclass(slots=True)
+class DeltaEncoder:
+    """
+    Encodes each state relative to the last one the client acknowledged,
+    with a full keyframe every `keyframe_interval` states (or whenever there
+    is nothing acknowledged to build on) so that the client can resync.
+
+    >>> encoder = DeltaEncoder(keyframe_interval=10)
+    >>> first = encoder.encode({"a": 1})
+    >>> first["keyframe"], first["added"]
+    (True, {'a': 1})
+    >>> encoder.ack(first["seq"])
+    >>> second = encoder.encode({"a": 2})
+    >>> second["keyframe"], second["base"], second["changed"]
+    (False, 1, {'a': 2})
+    """
+
+    keyframe_interval: int = 50
+    seq: int = 0
+    acked: tuple[int, dict[str, any]] | None = None
+    unacked: dict[int, dict[str, any]] = field(default_factory=dict)
+
+    def encode(self, entries: dict[str, any]) -> dict:
+        self.seq += 1
+        self.unacked[self.seq] = entries
+        keyframe = self.acked is None or self.seq % self.keyframe_interval == 0
+        if keyframe:
+            base, delta = None, diff({}, entries)
+            # Nothing sent before a keyframe will be needed as a base again
+            self.unacked = {self.seq: entries}
+        else:
+            base, old = self.acked
+            delta = diff(old, entries)
+        return {"seq": self.seq, "base": base, "keyframe": keyframe, **delta}
+
+    def ack(self, seq: int) -> None:
+        if seq not in self.unacked:
+            return
+        self.acked = seq, self.unacked[seq]
+        self.unacked = {
+            unacked: entries
+            for unacked, entries in self.unacked.items()
+            if unacked > seq
+        }
+
+
+@dataclass(slots=True)
+class History:
+    """
+    Every state of a session, as a keyframe every `keyframe_interval` steps
+    and a delta from the previous state otherwise, so that any step is
+    rebuilt by patching fewer than `keyframe_interval` deltas
+
+    >>> history = History(keyframe_interval=2)
+    >>> for i in range(5):
+    ...     _ = history.record({"i": i, f"step{i}": True})
+    >>> history.at(3)
+    {'i': 3, 'step3': True}
+    >>> len(history)
+    5
+    """
+
+    keyframe_interval: int = 50
+    keyframes: list[dict[str, any]] = field(default_factory=list)
+    deltas: list[dict] = field(default_factory=list)
+    last: dict[str, any] = field(default_factory=dict)
+
+    def __len__(self) -> int:
+        return len(self.deltas)
+
+    def record(self, entries: dict[str, any]) -> int:
+        """Append the next state, returning its step index"""
+
+        step = len(self.deltas)
+        if step % self.keyframe_interval == 0:
+            self.keyframes.append(entries)
+            self.deltas.append(None)
+        else:
+            self.deltas.append(diff(self.last, entries))
+        self.last = entries
+        return step
+
+    def truncate(self, steps: int) -> None:
+        """
+        Forget every state from step `steps` on
+
+        >>> history = History(keyframe_interval=2)
+        >>> for i in range(5):
+        ...     _ = history.record({"i": i})
+        >>> history.truncate(3)
+        >>> _ = history.record({"i": -1})
+        >>> [history.at(step)["i"] for step in range(len(history))]
+        [0, 1, 2, -1]
+        """
+
+        if steps >= len(self.deltas):
+            return
+        self.last = self.at(steps - 1) if steps else {}
+        del self.deltas[steps:]
+        del self.keyframes[-(-steps // self.keyframe_interval) :]
+
+    def at(self, step: int) -> dict[str, any]:
+        if not 0 <= step < len(self.deltas):
+            raise IndexError(f"No step {step} in history")
+        keyframe = step - step % self.keyframe_interval
+        entries = self.keyframes[keyframe // self.keyframe_interval]
+        for delta in self.deltas[keyframe + 1 : step + 1]:
+            entries = patch(entries, delta)
+        return entries
@@ -0,0 +1,94 @@
+from asyncio import create_task
+from asyncio import sleep
+from asyncio import Task
+from collections import deque
+from collections.abc import Awaitable
+from collections.abc import Callable
+from time import monotonic
+
+"""Streaming program output to the client without flooding it"""
+
+
+class OutputStream:
+    """
+    Buffers program output and sends it on in batches, at most `rate` per
+    second. At most `capacity` characters are kept: past that the oldest
+    output is dropped, and the next batch starts with a marker saying how
+    much.
+
+    >>> from asyncio import run
+    >>> async def demo():
+    ...     sent = list[str]()
+    ...     async def send(text: str, dropped: int) -> None:
+    ...         sent.append(text)
+    ...     stream = OutputStream(send, capacity=8, rate=1000)
+    ...     stream.write("hello ")
+    ...     stream.write("world\\n")
+    ...     await stream.flush()
+    ...     return sent, stream.dropped
+    >>> run(demo())
+    (['[... 4 characters of output dropped ...]\\no world\\n'], 4)
+    """
+
+    def __init__(
+        self,
+        send: Callable[[str, int], Awaitable[None]],
+        capacity: int = 64 * 1024,
+        rate: float = 20,
+    ) -> None:
+        self.send = send
+        self.capacity = capacity
+        self.rate = rate
+        self.chunks = deque[str]()
+        self.size = 0
+        # Characters dropped, over the whole session and since the last batch
+        self.dropped = 0
+        self.unreported = 0
+        self.last = 0.0
+        self.task: Task | None = None
+
+    def write(self, text: str) -> None:
+        if not text:
+            return
+        self.chunks.append(text)
+        self.size += len(text)
+        while self.size > self.capacity and self.chunks:
+            excess = self.size - self.capacity
+            oldest = self.chunks[0]
+            if len(oldest) <= excess:
+                self.chunks.popleft()
+                dropped = len(oldest)
+            else:
+                self.chunks[0] = oldest[excess:]
+                dropped = excess
+            self.size -= dropped
+            self.dropped += dropped
+            self.unreported += dropped
+        if self.task is None or self.task.done():
+            self.task = create_task(self._send_later())
+
+    async def flush(self) -> None:
+        """Send whatever is buffered right away"""
+
+        if not self.chunks and not self.unreported:
+            return
+        text = "".join(self.chunks)
+        if self.unreported:
+            text = (
+                f"[... {self.unreported} characters of output dropped ...]\n"
+                + text
+            )
+        self.chunks.clear()
+        self.size = 0
+        self.unreported = 0
+        self.last = monotonic()
+        await self.send(text, self.dropped)
+
+    def close(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+
+    async def _send_later(self) -> None:
+        # Whatever is written in the meantime goes in the same batch
+        await sleep(max(0, self.last + 1 / self.rate - monotonic()))
+        await self.flush()
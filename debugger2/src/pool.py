@@ -0,0 +1,193 @@
+from asyncio import create_task
+from asyncio import wait_for
+from asyncio import Event
+from asyncio import Task
+from collections import deque
+from collections.abc import Callable
+from contextlib import suppress
+from dataclasses import dataclass
+from logging import exception
+from time import monotonic
+
+from debugger import Debugger
+
+"""GDB sessions started ahead of time, so that "Run" does not wait on GDB"""
+
+
+@dataclass(slots=True)
+class PoolStats:
+    hits: int = 0
+    """Sessions handed out straight from the idle ones"""
+    misses: int = 0
+    """Sessions that had to be waited for, as none were idle"""
+    waits: int = 0
+    """Misses that found the pool at its maximum size"""
+    wait_time: float = 0.0
+    """Seconds spent waiting on misses, in all"""
+    started: int = 0
+    unhealthy: int = 0
+    """Idle sessions that failed a health check and were replaced"""
+    timeouts: int = 0
+    """Acquires that gave up waiting, with the pool at its maximum size"""
+
+
+class DebuggerPool:
+    """
+    Keeps `min_idle` GDB sessions started (with their pty, and the agent
+    loaded) but with no executable, up to `max_size` sessions in all,
+    including those in use. `acquire` hands one out to `load` an executable
+    into, and `release` ends it, as a used session is not reused.
+
+    Idle sessions are health checked every `check_interval` seconds, and
+    replenished in the background. With all `max_size` sessions in use,
+    `acquire` waits up to `timeout` seconds for one to be released.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], Debugger] = Debugger,
+        min_idle: int = 2,
+        max_size: int = 16,
+        check_interval: float = 30,
+        check_timeout: float = 5,
+        timeout: float | None = 60,
+    ) -> None:
+        self.factory = factory
+        self.min_idle = min_idle
+        self.max_size = max_size
+        self.check_interval = check_interval
+        self.check_timeout = check_timeout
+        self.timeout = timeout
+        self.idle = deque[Debugger]()
+        # Sessions started or starting, whether idle or in use
+        self.size = 0
+        self.stats = PoolStats()
+        self.task: Task | None = None
+        # Set to have the background task replenish the pool right away
+        self.wanted = Event()
+        # Set whenever a session becomes idle or a slot is freed
+        self.changed = Event()
+
+    def start(self) -> None:
+        self.task = create_task(self._maintain())
+
+    async def close(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            with suppress(BaseException):
+                await self.task
+            self.task = None
+        while self.idle:
+            await self._discard(self.idle.popleft())
+
+    async def acquire(self) -> Debugger:
+        start = monotonic()
+        hit = True
+        full = False
+        while True:
+            if debugger := await self._take_idle():
+                break
+            hit = False
+            if self.size < self.max_size:
+                debugger = await self._start()
+                self.wanted.set()
+                break
+            full = True
+            self.changed.clear()
+            if self.timeout is None:
+                await self.changed.wait()
+                continue
+            left = start + self.timeout - monotonic()
+            try:
+                await wait_for(self.changed.wait(), max(left, 0))
+            except TimeoutError:
+                self.stats.timeouts += 1
+                raise TimeoutError(
+                    f"All {self.max_size} GDB sessions are in use"
+                ) from None
+
+        if hit:
+            self.stats.hits += 1
+        else:
+            self.stats.misses += 1
+            self.stats.waits += full
+            self.stats.wait_time += monotonic() - start
+        return debugger
+
+    async def _take_idle(self) -> Debugger | None:
+        while self.idle:
+            debugger = self.idle.popleft()
+            self.wanted.set()
+            if debugger.alive():
+                return debugger
+            self.stats.unhealthy += 1
+            await self._discard(debugger)
+        return None
+
+    async def release(self, debugger: Debugger) -> None:
+        await self._discard(debugger)
+        self.wanted.set()
+
+    async def _start(self) -> Debugger:
+        self.size += 1
+        try:
+            debugger = await self.factory().init()
+        except BaseException:
+            self.size -= 1
+            self.changed.set()
+            raise
+        self.stats.started += 1
+        return debugger
+
+    async def _discard(self, debugger: Debugger) -> None:
+        try:
+            with suppress(OSError):
+                # e.g. a broken pipe to a GDB that is gone
+                await debugger.deinit()
+        finally:
+            self.size -= 1
+            self.changed.set()
+
+    async def _maintain(self) -> None:
+        check = True
+        while True:
+            self.wanted.clear()
+            if check:
+                await self._check()
+            while len(self.idle) < self.min_idle and self.size < self.max_size:
+                try:
+                    debugger = await self._start()
+                except Exception:
+                    # e.g. no GDB, which retrying right away will not fix
+                    exception("cannot start a GDB session for the pool")
+                    break
+                self.idle.append(debugger)
+                self.changed.set()
+            try:
+                await wait_for(self.wanted.wait(), self.check_interval)
+                check = False
+            except TimeoutError:
+                check = True
+
+    async def _check(self) -> None:
+        for debugger in list(self.idle):
+            if not await self._healthy(debugger) and debugger in self.idle:
+                # (It may have been handed out in the meantime)
+                self.idle.remove(debugger)
+                self.stats.unhealthy += 1
+                await self._discard(debugger)
+
+    async def _healthy(self, debugger: Debugger) -> bool:
+        if not debugger.alive():
+            return False
+        try:
+            (res,) = await wait_for(
+                debugger.run_commands(
+                    ["-gdb-version"], return_exceptions=True
+                ),
+                self.check_timeout,
+            )
+        except (OSError, TimeoutError):
+            # e.g. a broken pipe to GDB
+            return False
+        return not isinstance(res, BaseException)
@@ -1,3 +1,6 @@
+from asyncio import gather
+from collections.abc import Awaitable
+from collections.abc import Callable
 from dataclasses import asdict
 import json
 from pprint import pp
@@ -10,7 +13,11 @@ from uvicorn import run
 from socketio import AsyncServer
 from socketio import ASGIApp
 
-from debugger import Debugger, compile
+from debugger import Debugger, TracePolicy, compile
+from delta import DeltaEncoder, History, flatten, unflatten
+from output import OutputStream
+from pool import DebuggerPool
+from speculate import Speculator
 
 logging.basicConfig(level=logging.INFO)
 debug = logging.debug
@@ -25,7 +32,7 @@ server = AsyncServer(async_mode="asgi", cors_allowed_origins="*")
 
 
 class State:
-    async def init(self, code: str):
+    async def init(self, sid: str, code: str):
         fd, path = mkstemp(suffix=".c")
         os.close(fd)
         self.source = Path(path)
@@ -34,21 +41,56 @@ class State:
         os.close(fd)
         self.exe = Path(path)
 
-        self.debugger = Debugger()
-
         self.source.write_text(code)
-        await compile(self.source, self.exe)
-        await self.debugger.init(self.exe)
+        try:
+            await compile(self.source, self.exe)
+        except AssertionError:
+            self.exe.unlink()
+            self.source.unlink()
+            raise
+
+        try:
+            # A GDB already started, so only the executable is left to load
+            self.debugger = await pool.acquire()
+        except BaseException:
+            # e.g. a timeout, or the client leaving in the meantime
+            self.exe.unlink()
+            self.source.unlink()
+            raise
+        self.output = OutputStream(
+            lambda text, dropped: send_stdout(sid, text, dropped)
+        )
+
+        @self.debugger.on_inferior
+        def _(text: str) -> None:
+            # Output of redone steps was already sent, and output of steps
+            # taken ahead of the user is sent when the user gets there
+            if self.debugger.replaying or self.speculator.hold(text):
+                return
+            self.output.write(text)
 
         self.seen = set()
+        self.delta: DeltaEncoder | None = None
+        self.history = History()
+        # Debugger step of each state in the history
+        self.steps = list[int]()
+        self.speculator = Speculator(self.debugger)
+        try:
+            await self.debugger.load(self.exe)
+        except ValueError:
+            await self.deinit()
+            raise
         return self
 
     async def deinit(self):
-        await self.debugger.deinit()
+        await self.speculator.pause()
+        self.output.close()
+        await pool.release(self.debugger)
         self.exe.unlink()
         self.source.unlink()
 
 
+pool = DebuggerPool(lambda: Debugger(checkpoint_interval=10))
 state = dict[str, State]()
 
 
@@ -79,18 +121,23 @@ async def mainDebug(sid: str, code: str) -> None:
         del state[sid]
 
     try:
-        state[sid] = State()
-        await state[sid].init(code)
+        state[sid] = await State().init(sid, code)
     except AssertionError as e:
         info(f"[{sid}] failed to compile code")
         await server.emit("compileError", e.args[0][1].decode(), to=sid)
         return
+    except TimeoutError as e:
+        error(f"[{sid}] {e} ({pool.stats})")
+        await server.emit("debuggerUnavailable", str(e), to=sid)
+        return
 
-    for func in await state[sid].debugger.functions():
-        await state[sid].debugger.breakpoint(func)
-    await state[sid].debugger.run()
+    debugger = state[sid].debugger
+    await gather(*map(debugger.breakpoint, await debugger.functions()))
+    await debugger.track_allocations()
+    await debugger.run()
+    state[sid].speculator.resume()
 
-    info(f"[{sid}] compiled code")
+    info(f"[{sid}] compiled code ({pool.stats})")
     await server.emit(
         "mainDebug", "Finished mainDebug event on server", to=sid
     )
@@ -99,15 +146,192 @@ async def mainDebug(sid: str, code: str) -> None:
 @server.event
 async def executeNext(sid: str) -> None:
     assert sid in state
-    debugger = state[sid].debugger
-
-    await debugger.next()
-    info(f"[{sid}] run 'executeNext'")
+    speculator = state[sid].speculator
+
+    (legacy_types, legacy_mem), output = await speculator.next()
+    state[sid].output.write(output)
+    # Output comes before the state of the step that printed it
+    await state[sid].output.flush()
+    step = speculator.step
+    info(
+        f"[{sid}] run 'executeNext' "
+        f"({speculator.hits} hits, {speculator.misses} misses, "
+        f"{speculator.rewinds} rewinds in {speculator.rewind_time:.2f}s)"
+    )
     await server.emit(
         "executeNext", "Finished executeNext event on server-side", to=sid
     )
 
-    legacy_types, legacy_mem = await debugger.legacy_trace()
+    await send_state(sid, legacy_types, legacy_mem, step)
+
+
+async def run_until(
+    sid: str, name: str, step: Callable[[Debugger], Awaitable[dict]]
+) -> None:
+    """Take `step` as one step, tracing only where it stops"""
+
+    assert sid in state
+    speculator = state[sid].speculator
+    debugger = state[sid].debugger
+
+    await speculator.settle()
+    try:
+        await step(debugger)
+        info(f"[{sid}] run '{name}'")
+        await server.emit(
+            name, f"Finished {name} event on server-side", to=sid
+        )
+        legacy_types, legacy_mem = await debugger.legacy_trace()
+        step = debugger.step
+    finally:
+        speculator.resume()
+    await send_state(sid, legacy_types, legacy_mem, step)
+
+
+@server.event
+async def continueToLine(sid: str, line: int) -> None:
+    assert sid in state
+    source = state[sid].source
+    await run_until(
+        sid,
+        "continueToLine",
+        lambda debugger: debugger.until(f"{source}:{line}"),
+    )
+
+
+@server.event
+async def stepOut(sid: str) -> None:
+    await run_until(sid, "stepOut", lambda debugger: debugger.step_out())
+
+
+@server.event
+async def executeNextN(sid: str, count: int) -> None:
+    await run_until(
+        sid, "executeNextN", lambda debugger: debugger.next_n(count)
+    )
+
+
+@server.event
+async def continueUntil(sid: str, condition: str) -> None:
+    """Run until the C expression `condition` holds in the current function"""
+
+    try:
+        await run_until(
+            sid,
+            "continueUntil",
+            lambda debugger: debugger.until_true(condition),
+        )
+    except ValueError as e:
+        # Most likely a condition GDB cannot parse
+        await server.emit("continueUntilError", str(e), to=sid)
+
+
+@server.event
+async def continueUntilChange(sid: str, objects: list[dict]) -> None:
+    """Run until any of `objects` (with "addr" and "typeName") changes"""
+
+    targets = [(obj["addr"], obj["typeName"]) for obj in objects]
+    await run_until(
+        sid,
+        "continueUntilChange",
+        lambda debugger: debugger.watch_until(targets),
+    )
+
+
+@server.event
+async def captureBatch(sid: str, options: dict) -> None:
+    """
+    Run the program to completion, breaking at `options["lines"]` and
+    `options["functions"]`, and stream the state at each break as
+    "sendCaptureSnapshot", followed by "captureDone"
+    """
+
+    assert sid in state
+    speculator = state[sid].speculator
+    debugger = state[sid].debugger
+    source = state[sid].source
+    locations = [f"{source}:{line}" for line in options.get("lines", [])]
+    locations += options.get("functions", [])
+
+    await speculator.settle()
+    count = 0
+    first = debugger.step + 1
+    try:
+        # Tracing the next hit overlaps with sending this one
+        async for stop, (legacy_types, legacy_mem) in debugger.steps(
+            lambda debugger: debugger.until(*locations),
+            max_steps=options.get("maxHits", 1000),
+            legacy=True,
+        ):
+            await send_types(sid, legacy_types)
+            legacy_mem = json.loads(json.dumps(legacy_mem, default=asdict))
+            record(sid, legacy_mem, first + count)
+            await server.emit(
+                "sendCaptureSnapshot",
+                {
+                    "index": count,
+                    "line": int(stop["frame"]["line"]),
+                    "state": legacy_mem,
+                },
+                to=sid,
+            )
+            count += 1
+    finally:
+        speculator.resume()
+    info(f"[{sid}] captured {count} snapshots")
+    await server.emit("captureDone", {"count": count}, to=sid)
+
+
+async def send_stdout(sid: str, text: str, dropped: int) -> None:
+    await server.emit("sendStdoutToUser", text, to=sid)
+    if dropped:
+        # Total over the session, for clients that show it
+        await server.emit("sendStdoutDropped", {"dropped": dropped}, to=sid)
+
+
+@server.event
+async def setOutputLimits(sid: str, options: dict) -> None:
+    """
+    Send program output at most `options["rate"]` times a second, keeping at
+    most `options["capacity"]` characters of it buffered
+    """
+
+    assert sid in state
+    output = state[sid].output
+    rate = options.get("rate", output.rate)
+    capacity = options.get("capacity", output.capacity)
+    if not isinstance(rate, int | float) or rate <= 0:
+        error(f"[{sid}] invalid output rate {rate!r}")
+        return
+    if not isinstance(capacity, int) or capacity < 0:
+        error(f"[{sid}] invalid output capacity {capacity!r}")
+        return
+    output.rate = rate
+    output.capacity = capacity
+
+
+def record(sid: str, legacy_mem: dict, step: int) -> None:
+    state[sid].history.record(flatten(legacy_mem))
+    state[sid].steps.append(step)
+
+
+async def send_state(
+    sid: str, legacy_types: list[dict], legacy_mem: dict, step: int
+) -> None:
+    await send_types(sid, legacy_types)
+    legacy_mem = json.loads(json.dumps(legacy_mem, default=asdict))
+    record(sid, legacy_mem, step)
+    if state[sid].delta is None:
+        await server.emit("sendBackendStateToUser", legacy_mem, to=sid)
+    else:
+        await server.emit(
+            "sendBackendStateDelta",
+            state[sid].delta.encode(flatten(legacy_mem)),
+            to=sid,
+        )
+
+
+async def send_types(sid: str, legacy_types: list[dict]) -> None:
     for type in legacy_types:
         if type["typeName"] in state[sid].seen:
             continue
@@ -117,13 +341,199 @@ async def executeNext(sid: str) -> None:
             json.loads(json.dumps(type, default=asdict)),
             to=sid,
         )
+
+
+@server.event
+async def setTracePolicy(sid: str, options: dict | None = None) -> None:
+    """
+    Bound how much memory each step traces. Objects past the bounds are sent
+    with `"unexpanded": true`, to be fetched with "expandObject".
+    """
+
+    assert sid in state
+    options = options or {}
+    deadline = options.get("deadlineMs")
+    lowest = {"maxNodes": 0, "maxDepth": 0, "frames": 1}
+    for name, low in lowest.items():
+        value = options.get(name)
+        if value is not None and (not isinstance(value, int) or value < low):
+            error(f"[{sid}] invalid trace policy {name} {value!r}")
+            return
+    if deadline is not None and (
+        not isinstance(deadline, int | float) or deadline < 0
+    ):
+        error(f"[{sid}] invalid trace policy deadlineMs {deadline!r}")
+        return
+    # States traced ahead of time were traced under the old policy
+    await state[sid].speculator.settle()
+    state[sid].debugger.trace_policy = TracePolicy(
+        max_nodes=options.get("maxNodes"),
+        max_depth=options.get("maxDepth"),
+        deadline=None if deadline is None else deadline / 1000,
+        frames=options.get("frames"),
+    )
+    state[sid].speculator.resume()
+    info(f"[{sid}] set trace policy {state[sid].debugger.trace_policy}")
+
+
+@server.event
+async def expandObject(sid: str, obj: dict) -> None:
+    assert sid in state
+    debugger = state[sid].debugger
+
+    await state[sid].speculator.settle()
+    try:
+        legacy_types, heap_data = await debugger.legacy_expand(
+            obj["addr"], obj["typeName"]
+        )
+    finally:
+        state[sid].speculator.resume()
+    await send_types(sid, legacy_types)
+    await server.emit(
+        "sendExpandedObject",
+        {
+            "addr": obj["addr"],
+            "heap_data": json.loads(json.dumps(heap_data, default=asdict)),
+        },
+        to=sid,
+    )
+
+
+@server.event
+async def fetchRange(sid: str, obj: dict, start: int, count: int) -> None:
+    """
+    Send `count` elements of the array `obj` (with "addr" and "typeName")
+    from index `start`, or `count` nodes from `start` hops along the chain
+    that starts at the struct `obj` (following `obj["link"]`, if given), as
+    "sendRange"
+    """
+
+    assert sid in state
+    debugger = state[sid].debugger
+
+    await state[sid].speculator.settle()
+    try:
+        page = await debugger.page(
+            obj["addr"], obj["typeName"], start, count, obj.get("link")
+        )
+    except ValueError as e:
+        await server.emit("fetchRangeError", str(e), to=sid)
+        return
+    finally:
+        state[sid].speculator.resume()
     await server.emit(
-        "sendBackendStateToUser",
-        json.loads(json.dumps(legacy_mem, default=asdict)),
+        "sendRange",
+        {
+            "addr": obj["addr"],
+            "typeName": obj["typeName"],
+            "start": page.start,
+            "total": page.total,
+            "items": [
+                {
+                    "addr": item.addr,
+                    "typeName": item.type,
+                    "value": json.loads(
+                        json.dumps(item.value, default=asdict)
+                    ),
+                }
+                for item in page.items
+            ],
+        },
         to=sid,
     )
 
 
+@server.event
+async def setSpeculation(sid: str, options: dict) -> None:
+    """Step up to `depth` steps ahead of the user (0, the default, is off)"""
+
+    assert sid in state
+    speculator = state[sid].speculator
+    await speculator.settle()
+    speculator.depth = options.get("depth", speculator.depth)
+    speculator.resume()
+
+
+@server.event
+async def enableDeltaState(sid: str, options: dict | None = None) -> None:
+    """
+    Opt in to receiving "sendBackendStateDelta" instead of
+    "sendBackendStateToUser". Each delta is relative to the last state
+    acknowledged with "ackBackendState".
+    """
+
+    assert sid in state
+    options = options or {}
+    interval = options.get("keyframeInterval", 50)
+    if not isinstance(interval, int) or interval < 1:
+        error(f"[{sid}] invalid keyframe interval {interval!r}")
+        return
+    state[sid].delta = DeltaEncoder(interval)
+    info(f"[{sid}] enabled delta encoded backend state")
+
+
+@server.event
+async def ackBackendState(sid: str, seq: int) -> None:
+    assert sid in state
+    if state[sid].delta is not None:
+        state[sid].delta.ack(seq)
+
+
+@server.event
+async def fetchState(sid: str, step: int) -> None:
+    """
+    Emit the `step`th backend state sent (counting from 0) as
+    "sendBackendStateAtStep", without touching GDB
+    """
+
+    assert sid in state
+    history = state[sid].history
+    if not 0 <= step < len(history):
+        await server.emit(
+            "sendBackendStateAtStep",
+            {"step": step, "steps": len(history), "state": None},
+            to=sid,
+        )
+        return
+    await server.emit(
+        "sendBackendStateAtStep",
+        {
+            "step": step,
+            "steps": len(history),
+            "state": unflatten(history.at(step)),
+        },
+        to=sid,
+    )
+
+
+@server.event
+async def restartFromStep(sid: str, step: int) -> None:
+    """
+    Rewind the program to how it was at the `step`th state sent (as
+    numbered by "fetchState"), so that it can go on from there. Replies
+    with "sendBackendStateAtStep".
+    """
+
+    assert sid in state
+    history = state[sid].history
+    if not 0 <= step < len(history):
+        error(f"[{sid}] cannot restart from step {step}")
+        return
+    # The restart rewinds past whatever was speculated anyway
+    await state[sid].speculator.settle(rewind=False)
+    try:
+        await state[sid].debugger.restart(state[sid].steps[step])
+    except ValueError as e:
+        error(f"[{sid}] cannot restart from step {step}: {e}")
+        return
+    finally:
+        state[sid].speculator.resume()
+    history.truncate(step + 1)
+    del state[sid].steps[step + 1 :]
+    info(f"[{sid}] restarted from step {step}")
+    await fetchState(sid, step)
+
+
 @server.event
 async def EOF(sid: str) -> None:
     error("event 'EOF' not implemented")
@@ -139,7 +549,12 @@ async def send_stdin(sid: str) -> None:
     error("event 'send_stdin' not implemented")
 
 
-app = ASGIApp(server, socketio_path="/debugger")
+app = ASGIApp(
+    server,
+    socketio_path="/debugger",
+    on_startup=pool.start,
+    on_shutdown=pool.close,
+)
 
 if __name__ == "__main__":
     host = "0.0.0.0"
@@ -0,0 +1,163 @@
+from asyncio import create_task
+from asyncio import shield
+from asyncio import wait_for
+from asyncio import Task
+from collections import deque
+from pathlib import Path
+from re import compile
+from time import monotonic
+
+from debugger import Debugger
+
+"""Stepping ahead of the user while they look at the current step"""
+
+# Calls that may block on stdin, which the user has not typed yet
+READS_STDIN = compile(
+    r"\b(scanf|getchar|getc|fgetc|fgets|gets|getline|fread|read)\s*\("
+)
+
+
+class Speculator:
+    """
+    Runs `next` and `legacy_trace` in the background, up to `depth` steps
+    ahead of the user, so that their next "executeNext" is answered from
+    the look-ahead buffer. Speculation is off until `depth` is set, and
+    stops at lines that may read stdin. A step that takes longer than
+    `timeout` to pause anyway (e.g. on input the source check missed) is
+    interrupted and undone.
+
+    Anything else that uses the debugger must `settle` first, which rewinds
+    the inferior to the user's step through GDB checkpoints (a restart and
+    a replay, counted in `rewinds` and `rewind_time`), so speculation is
+    only enabled when the debugger takes checkpoints.
+
+    Program output is `hold`en back while speculating, and released along
+    with the state of the step that printed it.
+    """
+
+    def __init__(
+        self, debugger: Debugger, depth: int = 0, timeout: float = 1
+    ) -> None:
+        self.debugger = debugger
+        self.depth = depth
+        self.timeout = timeout
+        self.buffer = deque[tuple | BaseException]()
+        self.outputs = deque[str]()
+        self.output: list[str] | None = None
+        self.task: Task | None = None
+        # The debugger step the user is at
+        self.step = 0
+        self.stopping = False
+        self.sources = dict[str, list[str]]()
+        self.hits = 0
+        self.misses = 0
+        self.rewinds = 0
+        self.rewind_time = 0.0
+
+    async def next(self) -> tuple[tuple, str]:
+        """
+        Step once, as seen by the user, and return the legacy trace and the
+        output held back for that step
+        """
+
+        await self.pause()
+        output = ""
+        if self.buffer:
+            self.hits += 1
+            result = self.buffer.popleft()
+            output = self.outputs.popleft()
+        else:
+            self.misses += 1
+            try:
+                await self.debugger.next()
+                result = await self.debugger.legacy_trace()
+            except ValueError as e:
+                result = e
+        self.resume()
+        if isinstance(result, BaseException):
+            raise result
+        return result, output
+
+    def hold(self, output: str) -> bool:
+        """Hold `output` back if a speculative step printed it"""
+
+        if self.output is None:
+            return False
+        self.output.append(output)
+        return True
+
+    async def settle(self, rewind: bool = True) -> None:
+        """
+        Stop speculating and rewind to the user's step, unless the caller
+        is about to `restart` the debugger anyway
+        """
+
+        await self.pause()
+        if self.buffer:
+            self.buffer.clear()
+            # The inferior will print it again, if the user gets there
+            self.outputs.clear()
+            if rewind:
+                await self._rewind()
+        self.step = self.debugger.step
+
+    async def _rewind(self) -> None:
+        start = monotonic()
+        await self.debugger.restart(self.step)
+        self.rewinds += 1
+        self.rewind_time += monotonic() - start
+
+    def resume(self) -> None:
+        # Whatever the caller did since `settle`, the user is here now
+        self.step = self.debugger.step - len(self.buffer)
+        if self.depth > 0 and self.debugger.checkpoints is not None:
+            self.stopping = False
+            self.task = create_task(self._speculate())
+
+    async def pause(self) -> None:
+        if self.task is None:
+            return
+        # A step in flight has to finish for `step` to stay accurate
+        self.stopping = True
+        try:
+            await wait_for(shield(self.task), self.timeout)
+        except TimeoutError:
+            # It may never finish, e.g. waiting on input
+            self.debugger.interrupt()
+            await self.task
+            self.buffer.clear()
+            self.outputs.clear()
+            await self._rewind()
+        self.task = None
+
+    async def _speculate(self) -> None:
+        while not self.stopping and len(self.buffer) < self.depth:
+            if self.buffer and isinstance(self.buffer[-1], BaseException):
+                return
+            try:
+                if await self._reads_stdin():
+                    return
+                self.output = []
+                await self.debugger.next()
+                result = await self.debugger.legacy_trace()
+            except ValueError as e:
+                # e.g. the program exited, which the user will see too
+                result = e
+            finally:
+                output, self.output = self.output, None
+            self.buffer.append(result)
+            self.outputs.append("".join(output or ()))
+
+    async def _reads_stdin(self) -> bool:
+        frame = (await self.debugger.frames())[0]
+        if frame.file not in self.sources:
+            try:
+                text = Path(frame.file).read_text(errors="replace")
+            except OSError:
+                text = ""
+            self.sources[frame.file] = text.splitlines()
+        lines = self.sources[frame.file]
+        if not 0 < frame.line <= len(lines):
+            # Unknown source, so be safe
+            return True
+        return READS_STDIN.search(lines[frame.line - 1]) is not None
@@ -0,0 +1,76 @@
+from asyncio import sleep
+from pathlib import Path
+
+from pytest import raises
+
+from debugger import Debugger, compile
+from pool import DebuggerPool
+
+here = Path(__file__).parent / "debugger"
+
+
+async def idle(pool: DebuggerPool, count: int) -> None:
+    for _ in range(100):
+        if len(pool.idle) >= count:
+            return
+        await sleep(0.1)
+    raise AssertionError(f"{len(pool.idle)} idle sessions, not {count}")
+
+
+async def test_pool():
+    source = here / "test_fibonacci.c"
+    exe = here / "exe_pool"
+    await compile(source, exe)
+
+    pool = DebuggerPool(lambda: Debugger(use_agent=False), min_idle=2)
+    try:
+        pool.start()
+        await idle(pool, 2)
+        assert pool.stats.started == 2
+
+        # An idle session is handed out, and replaced in the background
+        debug = await pool.acquire()
+        assert pool.stats.hits == 1
+        await idle(pool, 2)
+        assert pool.size == 3
+        await debug.load(exe)
+        await debug.breakpoint("fibonacci")
+        await debug.run()
+        assert (await debug.frames())[0].func == "fibonacci"
+        await pool.release(debug)
+        assert pool.size == 2
+
+        # A session whose GDB died is not handed out
+        dead = pool.idle[0]
+        dead.process.kill()
+        await dead.process.wait()
+        debug = await pool.acquire()
+        assert debug is not dead and debug.alive()
+        assert pool.stats.unhealthy == 1
+        await pool.release(debug)
+    finally:
+        await pool.close()
+        exe.unlink()
+    assert pool.size == 0
+
+
+async def test_pool_max_size():
+    pool = DebuggerPool(
+        lambda: Debugger(use_agent=False), min_idle=0, max_size=1, timeout=1
+    )
+    try:
+        pool.start()
+        debug = await pool.acquire()
+        assert pool.stats.misses == 1
+
+        with raises(TimeoutError):
+            await pool.acquire()
+        assert pool.stats.timeouts == 1
+
+        # A released session frees its slot for a waiting acquire
+        await pool.release(debug)
+        debug = await pool.acquire()
+        assert pool.size == 1
+        await pool.release(debug)
+    finally:
+        await pool.close()
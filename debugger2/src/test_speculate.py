@@ -0,0 +1,109 @@
+from asyncio import sleep
+from pathlib import Path
+
+from debugger import Debugger, compile
+from speculate import Speculator
+
+here = Path(__file__).parent / "debugger"
+
+
+async def start(debug: Debugger, exe: Path, function: str) -> None:
+    await debug.init(exe)
+    await debug.breakpoint(function)
+    await debug.run()
+
+
+async def test_speculate():
+    source = here / "test_fibonacci.c"
+    exe = here / "exe_speculate"
+    await compile(source, exe)
+
+    plain = Debugger(use_agent=False)
+    debug = Debugger(use_agent=False, checkpoint_interval=2)
+    speculator = Speculator(debug, depth=3)
+    output = list[str]()
+    plain.on_inferior(output.append)
+
+    @debug.on_inferior
+    def _(text: str) -> None:
+        if not debug.replaying and not speculator.hold(text):
+            output.append(text)
+
+    try:
+        # What stepping without speculation shows
+        await start(plain, exe, "fibonacci")
+        expected = list[tuple]()
+        for _ in range(8):
+            await plain.next()
+            expected.append((await plain.legacy_trace(), "".join(output)))
+            output.clear()
+
+        await start(debug, exe, "fibonacci")
+        speculator.resume()
+        for _ in range(50):
+            if len(speculator.buffer) == speculator.depth:
+                break
+            await sleep(0.1)
+        assert len(speculator.buffer) == speculator.depth
+
+        for step, (state, printed) in enumerate(expected, 1):
+            result, held = await speculator.next()
+            assert result == state
+            assert held + "".join(output) == printed
+            output.clear()
+            assert speculator.step == step
+        assert speculator.hits >= speculator.depth
+        assert speculator.hits + speculator.misses == len(expected)
+
+        # Rewinds past whatever was stepped ahead
+        ahead = len(speculator.buffer)
+        await speculator.settle()
+        assert debug.step == speculator.step == len(expected)
+        assert not speculator.buffer
+        assert speculator.rewinds >= (ahead > 0)
+
+    finally:
+        await speculator.pause()
+        await plain.deinit()
+        await debug.deinit()
+        exe.unlink()
+
+
+async def test_speculate_interrupt():
+    source = here / "test_speculate.c"
+    exe = here / "exe_speculate_interrupt"
+    await compile(source, exe)
+
+    debug = Debugger(use_agent=False, checkpoint_interval=2)
+    speculator = Speculator(debug, depth=4, timeout=0.5)
+    output = list[str]()
+
+    @debug.on_inferior
+    def _(text: str) -> None:
+        if not debug.replaying and not speculator.hold(text):
+            output.append(text)
+
+    try:
+        await start(debug, exe, "main")
+        # Three steps ahead, the fourth blocks in sleep(5)
+        speculator.resume()
+        await sleep(1)
+        assert len(speculator.buffer) == 3
+
+        # It is interrupted and undone, and the user steps on their own
+        await speculator.next()
+        assert speculator.rewinds == 1
+        assert speculator.misses == 1
+        assert debug.step == speculator.step == 1
+        assert (await debug.frames())[0].line == 6
+        assert (await debug.variables())["a"] == "1"
+
+        # Output held for the undone steps is printed when stepped again
+        await speculator.pause()
+        await debug.next()
+        assert "".join(output) == "start\n"
+
+    finally:
+        await speculator.pause()
+        await debug.deinit()
+        exe.unlink()